@@ -0,0 +1,285 @@
+"""Offline benchmark for the giveaway draw
+
+Builds synthetic guilds (no Discord, no database) whose entrants vary in roles, booster tiers, levels
+and message counts, then runs the same code end_giveaway uses: compile the eligibility rules, build
+the pool from the tracked entrants and draw weighted winners. Reports timings, peak memory and how
+closely the winner distribution follows each entrant's weight.
+
+Usage:
+    python giveaway_draw_benchmark.py
+    python giveaway_draw_benchmark.py --sizes 1000 10000 --winners 20 --trials 500 --output draw.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from datetime import datetime
+
+# Keep the bot offline - an empty value also stops load_dotenv from filling it in from .env
+os.environ['MONGODB_URI'] = ''
+
+import main  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+REQUIRED_ROLE_ID = 1
+BLACKLISTED_ROLE_ID = 2
+MEGA_BOOSTER_ROLE_ID = 1397371634012258374
+SUPER_BOOSTER_ROLE_ID = 1397371603255296181
+SERVER_BOOSTER_ROLE_ID = 1397361697324269679
+
+
+class FakeRole:
+    """Just enough of discord.Role for the draw"""
+
+    def __init__(self, role_id, name):
+        self.id = role_id
+        self.name = name
+
+    def __eq__(self, other):
+        return isinstance(other, FakeRole) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class FakeGuild:
+    """Just enough of discord.Guild for the draw"""
+
+    def __init__(self, roles):
+        self.roles = roles
+        self._roles_by_id = {role.id: role for role in roles}
+        self._members = {}
+
+    def get_role(self, role_id):
+        return self._roles_by_id.get(role_id)
+
+    def get_member(self, user_id):
+        return self._members.get(user_id)
+
+
+class FakeMember:
+    """Just enough of discord.Member for the draw"""
+
+    def __init__(self, user_id, guild, role_ids, premium_since):
+        self.id = user_id
+        self.bot = False
+        self.guild = guild
+        self.premium_since = premium_since
+        self._role_ids = role_ids
+
+    @property
+    def roles(self):
+        return [self.guild.get_role(role_id) for role_id in self._role_ids]
+
+    def get_role(self, role_id):
+        return self.guild.get_role(role_id) if role_id in self._role_ids else None
+
+    @property
+    def mention(self):
+        return f"<@{self.id}>"
+
+
+def build_guild(size, rng):
+    """Build a guild of size entrants with a realistic spread of roles, boosts, levels and activity"""
+    guild = FakeGuild([
+        FakeRole(REQUIRED_ROLE_ID, "Giveaway Access"),
+        FakeRole(BLACKLISTED_ROLE_ID, "No Giveaways"),
+        FakeRole(MEGA_BOOSTER_ROLE_ID, "Mega Booster"),
+        FakeRole(SUPER_BOOSTER_ROLE_ID, "Super Booster"),
+        FakeRole(SERVER_BOOSTER_ROLE_ID, "Server Booster")
+    ])
+
+    main.user_levels.clear()
+    main.message_counts.clear()
+
+    entrants = {}
+    for index in range(size):
+        user_id = 10_000_000 + index
+        role_ids = set()
+        if rng.random() < 0.9:
+            role_ids.add(REQUIRED_ROLE_ID)
+        if rng.random() < 0.03:
+            role_ids.add(BLACKLISTED_ROLE_ID)
+
+        premium_since = None
+        boost_roll = rng.random()
+        if boost_roll < 0.01:
+            role_ids.add(MEGA_BOOSTER_ROLE_ID)
+        elif boost_roll < 0.03:
+            role_ids.add(SUPER_BOOSTER_ROLE_ID)
+        elif boost_roll < 0.08:
+            role_ids.add(SERVER_BOOSTER_ROLE_ID)
+        if boost_roll < 0.08:
+            premium_since = datetime.utcnow()
+
+        member = FakeMember(user_id, guild, role_ids, premium_since)
+        guild._members[user_id] = member
+
+        # Most members are low level and a few are very active
+        main.user_levels[user_id] = {'xp': 0, 'level': min(100, int(rng.paretovariate(1.5))), 'last_message': datetime.utcnow()}
+        main.message_counts[user_id] = {'total': int(rng.lognormvariate(5, 1.2))}
+
+        entrants[str(user_id)] = 0
+
+    return guild, entrants
+
+
+def get_peak_rss_kb():
+    """Peak resident set size of this process in KB"""
+    if resource is None:
+        import psutil
+        return psutil.Process().memory_info().rss // 1024
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak //= 1024  # macOS reports bytes
+    return peak
+
+
+def timed(func, *args):
+    """Run func and return (result, milliseconds, peak traced bytes)"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed_ms, peak_bytes
+
+
+def run_size(size, winners, trials, rng):
+    """Benchmark one guild size and return its results"""
+    guild, entrants = build_guild(size, rng)
+    giveaway = {
+        'required_role_id': REQUIRED_ROLE_ID,
+        'blacklisted_role_id': BLACKLISTED_ROLE_ID,
+        'rig_winner': None,
+        'entrants': entrants
+    }
+
+    get_entry_weight = main.compile_giveaway_eligibility(giveaway, guild)
+
+    # What on_raw_reaction_add does as members enter, spread over the giveaway's lifetime
+    def evaluate_entries():
+        for user_id_str in entrants:
+            entrants[user_id_str] = get_entry_weight(guild.get_member(int(user_id_str)))
+    _, entry_ms, _ = timed(evaluate_entries)
+
+    # What end_giveaway does at the end
+    pool, pool_ms, pool_peak = timed(main.build_giveaway_pool, entrants, guild, get_entry_weight)
+    drawn, draw_ms, draw_peak = timed(main.draw_weighted_winners, pool, winners, lambda member: get_entry_weight(member) > 0)
+
+    draw_times = [draw_ms]
+    for _ in range(min(trials, 20) - 1):
+        start = time.perf_counter()
+        main.draw_weighted_winners(pool, winners, lambda member: get_entry_weight(member) > 0)
+        draw_times.append((time.perf_counter() - start) * 1000)
+
+    # Fairness - single-winner draws should land on each weight class in proportion to its total weight
+    weight_by_member = {member.id: weight for member, weight in pool}
+    total_weight = sum(weight_by_member.values())
+    class_weight = defaultdict(int)
+    class_size = Counter()
+    for weight in weight_by_member.values():
+        class_weight[weight] += weight
+        class_size[weight] += 1
+
+    wins = Counter()
+    for _ in range(trials):
+        winner = main.draw_weighted_winners(pool, 1)[0]
+        wins[weight_by_member[winner.id]] += 1
+
+    distribution = []
+    chi_square = 0.0
+    total_variation = 0.0
+    for weight in sorted(class_weight):
+        expected_share = class_weight[weight] / total_weight
+        observed_share = wins[weight] / trials
+        expected_wins = expected_share * trials
+        chi_square += (wins[weight] - expected_wins) ** 2 / expected_wins
+        total_variation += abs(observed_share - expected_share) / 2
+        distribution.append({
+            'weight': weight,
+            'entrants': class_size[weight],
+            'expected_share': round(expected_share, 4),
+            'observed_share': round(observed_share, 4)
+        })
+
+    return {
+        'entrants': size,
+        'eligible': len(pool),
+        'total_weight': total_weight,
+        'entry_evaluation_us_per_member': round(entry_ms * 1000 / size, 2),
+        'build_pool_ms': round(pool_ms, 3),
+        'draw_ms': {
+            'first': round(draw_ms, 3),
+            'mean': round(statistics.fmean(draw_times), 3),
+            'max': round(max(draw_times), 3)
+        },
+        'peak_traced_kb': {
+            'build_pool': pool_peak // 1024,
+            'draw': draw_peak // 1024
+        },
+        'winners_drawn': len(drawn),
+        'fairness': {
+            'trials': trials,
+            'chi_square': round(chi_square, 2),
+            'degrees_of_freedom': len(class_weight) - 1,
+            'total_variation_distance': round(total_variation, 4),
+            'by_weight': distribution
+        }
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark the giveaway draw offline")
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000, 100000], help="entrant counts to simulate")
+    parser.add_argument('--winners', type=int, default=10, help="winners per draw")
+    parser.add_argument('--trials', type=int, default=500, help="single-winner draws used to check fairness (each is O(entrants))")
+    parser.add_argument('--seed', type=int, default=1234, help="seed for the synthetic guilds and the draws")
+    parser.add_argument('--output', default='giveaway_draw_benchmark.json', help="where to write the JSON results")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    random.seed(args.seed)  # the draw itself uses the global generator
+    results = {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform()
+        },
+        'settings': {
+            'sizes': args.sizes,
+            'winners': args.winners,
+            'trials': args.trials,
+            'seed': args.seed
+        },
+        'runs': []
+    }
+
+    for size in args.sizes:
+        run = run_size(size, args.winners, args.trials, rng)
+        results['runs'].append(run)
+        print(f"{size:>7} entrants: pool {run['build_pool_ms']:.1f} ms, draw {run['draw_ms']['mean']:.1f} ms, "
+              f"entry check {run['entry_evaluation_us_per_member']:.1f} us/member, "
+              f"peak {max(run['peak_traced_kb'].values())} KB traced, "
+              f"TV distance {run['fairness']['total_variation_distance']:.3f}")
+
+    results['peak_rss_kb'] = get_peak_rss_kb()
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -14,44 +14,68 @@ import re
 import uuid
 import logging
 import time
-from PIL import Image, ImageDraw, ImageFont
-import requests
+import heapq
+import math
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image
 from io import BytesIO
 import yt_dlp
 import psutil
 from pymongo import MongoClient
 from bson.objectid import ObjectId
+from rank_card import (
+    IMAGE_FORMATS, LEADERBOARD_AVATAR_SIZE, LeaderboardCardRequest, LeaderboardCardRow, RankCardRequest,
+    discover_rank_card_font, generate_leaderboard_card, generate_rank_card, get_progress_width, init_render_worker,
+    mask_circle
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
-import os
-from dotenv import load_dotenv
-
-# Only load .env if running locally and not in Replit
-if not os.getenv("REPL_SLUG"):  # REPL_SLUG is set in Replit
-    load_dotenv()
-
-TOKEN = os.getenv("TOKEN")
-# MongoDB Connection
-MONGODB_URI = os.getenv("MONGODB_URI")
-if MONGODB_URI:
-    try:
-        mongo_client = MongoClient(MONGODB_URI)
-        db = mongo_client['hp_bot']
-        users_collection = db['users']
-        warnings_collection = db['warnings']
-        punishments_collection = db['punishments']
-        giveaways_collection = db['giveaways']
-        invites_collection = db['invites']
-        messages_collection = db['messages']
-        logging.info("✅ Connected to MongoDB")
-    except Exception as e:
-        logging.error(f"❌ MongoDB connection failed: {e}")
+# Startup with side effects (.env, MongoDB, the data directory, font discovery) runs from the __main__ block at the
+# bottom - spawned render workers re-import this file as __mp_main__ and must not connect to anything
+TOKEN = None
+MONGODB_URI = None
+mongo_client = None
+
+def load_environment():
+    """Read the bot token and MongoDB URI, loading .env when running locally"""
+    global TOKEN, MONGODB_URI
+    # Only load .env if running locally and not in Replit
+    if not os.getenv("REPL_SLUG"):  # REPL_SLUG is set in Replit
+        load_dotenv()
+
+    TOKEN = os.getenv("TOKEN")
+    MONGODB_URI = os.getenv("MONGODB_URI")
+
+def connect_database():
+    """Connect to MongoDB, falling back to local JSON storage if it isn't configured or reachable"""
+    global mongo_client, db, users_collection, warnings_collection, punishments_collection, giveaways_collection
+    global invites_collection, messages_collection, settings_collection, giveaway_entries_collection
+    if MONGODB_URI:
+        try:
+            mongo_client = MongoClient(MONGODB_URI)
+            db = mongo_client['hp_bot']
+            users_collection = db['users']
+            warnings_collection = db['warnings']
+            punishments_collection = db['punishments']
+            giveaways_collection = db['giveaways']
+            invites_collection = db['invites']
+            messages_collection = db['messages']
+            settings_collection = db['settings']
+            giveaway_entries_collection = db['giveaway_entries']
+            # Serves the startup queries for giveaways that haven't ended, split by end time
+            giveaways_collection.create_index([('ended', 1), ('end_time', 1)])
+            logging.info("✅ Connected to MongoDB")
+        except Exception as e:
+            logging.error(f"❌ MongoDB connection failed: {e}")
+            mongo_client = None
+    else:
+        logging.warning("⚠️ MONGODB_URI not set - using local JSON storage (data will reset on restart)")
         mongo_client = None
-else:
-    logging.warning("⚠️ MONGODB_URI not set - using local JSON storage (data will reset on restart)")
-    mongo_client = None
 
 intents = discord.Intents.default()
 intents.members = True
@@ -67,20 +91,21 @@ LEVELS_FILE = f"{DATA_DIR}/user_levels.json"
 WARNINGS_FILE = f"{DATA_DIR}/user_warnings.json"
 PUNISHMENTS_FILE = f"{DATA_DIR}/active_punishments.json"
 GIVEAWAYS_FILE = f"{DATA_DIR}/active_giveaways.json"
-
-# Create data directory
-os.makedirs(DATA_DIR, exist_ok=True)
+SETTINGS_FILE = f"{DATA_DIR}/guild_settings.json"
 
 # Store active giveaways
 active_giveaways = {}
 
 # Store user warnings and punishments
 user_warnings = {}  # {user_id: {'warnings': count, 'history': [{'id': str, 'reason': str, 'date': datetime, 'moderator': str}]}}
-active_punishments = {}  # {user_id: {'type': 'mute'/'ban', 'until': datetime, 'reason': str}}
+active_punishments = {}  # {user_id: {'type': 'mute'/'tempban', 'until': datetime, 'reason': str, 'guild_id': int | None}}
 
 # Store user XP and levels
 user_levels = {}  # {user_id: {'xp': int, 'level': int, 'last_message': datetime}}
 
+# Store per-server settings
+guild_settings = {}  # {guild_id: {'rank_card_format': str, 'rank_card_max_bytes': int | None, 'raid_action': str}}
+
 # Level perk role mapping
 LEVEL_PERK_ROLES = {
     5: 1399183777053540482,   # Stream permissions
@@ -149,13 +174,14 @@ def save_data():
                 punishments_data[str(user_id)] = {
                     'type': data['type'],
                     'until': data['until'].isoformat(),
-                    'reason': data['reason']
+                    'reason': data['reason'],
+                    'guild_id': data.get('guild_id')
                 }
 
             giveaways_data = {}
             for msg_id, data in active_giveaways.items():
                 giveaways_data[str(msg_id)] = {
-                    **data,
+                    **get_giveaway_record(data),
                     'end_time': data['end_time'].isoformat()
                 }
 
@@ -177,6 +203,8 @@ def save_data():
             with open(GIVEAWAYS_FILE, 'w') as f:
                 json.dump(giveaways_data, f, indent=2)
 
+            flush_giveaway_entrants()
+
             with open(INVITES_FILE, 'w') as f:
                 json.dump(invites_data, f, indent=2)
 
@@ -187,6 +215,10 @@ def save_data():
 
             with open(MESSAGES_FILE, 'w') as f:
                 json.dump(messages_data, f, indent=2)
+
+            settings_data = {str(guild_id): data for guild_id, data in guild_settings.items()}
+            with open(SETTINGS_FILE, 'w') as f:
+                json.dump(settings_data, f, indent=2)
         except Exception as e:
             logging.error(f"Error saving data to files: {e}")
         return
@@ -231,17 +263,19 @@ def save_data():
                         'type': data['type'],
                         'until': data['until'],
                         'reason': data['reason'],
+                        'guild_id': data.get('guild_id'),
                         'type_doc': 'punishments'
                     }
                 },
                 upsert=True
             )
 
-        # Save active giveaways
+        # Save active giveaways - entrants are written separately, only what changed
+        flush_giveaway_entrants()
         for msg_id, data in active_giveaways.items():
             # Convert datetime objects to ISO format for MongoDB storage
             giveaway_data_for_db = {}
-            for key, value in data.items():
+            for key, value in get_giveaway_record(data).items():
                 if isinstance(value, datetime):
                     giveaway_data_for_db[key] = value.isoformat()
                 else:
@@ -253,7 +287,9 @@ def save_data():
                     '$set': {
                         **giveaway_data_for_db,
                         'type_doc': 'giveaways'
-                    }
+                    },
+                    # Drop copies saved inside the record before they had their own storage
+                    '$unset': {field: '' for field in GIVEAWAY_SEPARATE_FIELDS}
                 },
                 upsert=True
             )
@@ -291,6 +327,20 @@ def save_data():
                 upsert=True
             )
 
+        # Save server settings
+        settings_collection = db['settings']
+        for guild_id, data in guild_settings.items():
+            settings_collection.update_one(
+                {'_id': guild_id},
+                {
+                    '$set': {
+                        **data,
+                        'type': 'settings'
+                    }
+                },
+                upsert=True
+            )
+
         logging.debug("✅ All data saved to MongoDB")
     except Exception as e:
         logging.error(f"Error saving to MongoDB: {e}")
@@ -321,13 +371,14 @@ def save_data():
                 punishments_data[str(user_id)] = {
                     'type': data['type'],
                     'until': data['until'].isoformat(),
-                    'reason': data['reason']
+                    'reason': data['reason'],
+                    'guild_id': data.get('guild_id')
                 }
 
             giveaways_data = {}
             for msg_id, data in active_giveaways.items():
                 giveaways_data[str(msg_id)] = {
-                    **data,
+                    **get_giveaway_record(data),
                     'end_time': data['end_time'].isoformat()
                 }
 
@@ -359,10 +410,38 @@ def save_data():
 
             with open(MESSAGES_FILE, 'w') as f:
                 json.dump(messages_data, f, indent=2)
+
+            settings_data = {str(guild_id): data for guild_id, data in guild_settings.items()}
+            with open(SETTINGS_FILE, 'w') as f:
+                json.dump(settings_data, f, indent=2)
             logging.info("💾 Data saved to JSON files as fallback")
         except Exception as fallback_e:
             logging.error(f"Error saving to JSON files as fallback: {fallback_e}")
 
+# Fire-and-forget tasks - the event loop only keeps weak references to tasks, so they're held here until done
+background_tasks = set()
+
+def start_background_task(coro):
+    """Run a coroutine in the background, keeping a reference to it until it finishes"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+# Debounced saving - bursts of small changes (like giveaway entries) share one save
+save_data_task = None
+
+def schedule_save_data(delay_seconds=10):
+    """Save data after a short delay, folding in any other changes made in the meantime"""
+    global save_data_task
+    if save_data_task is None or save_data_task.done():
+        save_data_task = asyncio.create_task(save_data_after_delay(delay_seconds))
+
+async def save_data_after_delay(delay_seconds):
+    """Wait, then save"""
+    await asyncio.sleep(delay_seconds)
+    save_data()
+
 async def load_data():
     """Load all data from MongoDB or files"""
     global user_levels, user_warnings, active_punishments, active_giveaways
@@ -373,6 +452,12 @@ async def load_data():
     active_punishments = active_punishments if 'active_punishments' in globals() else {}
     active_giveaways = active_giveaways if 'active_giveaways' in globals() else {}
 
+    # Cached leaderboards were built from the data being replaced
+    leaderboard_cache.clear()
+
+    # Giveaways that ended while the bot was offline, processed once loading is done
+    overdue_giveaways = []
+
     if mongo_client:
         # Load from MongoDB
         try:
@@ -409,25 +494,23 @@ async def load_data():
                 else:
                     until_date = until_date_raw
 
-                # Only load if punishment hasn't expired
-                if until_date > datetime.utcnow():
-                    active_punishments[user_id] = {
-                        'type': doc.get('type'),
-                        'until': until_date,
-                        'reason': doc.get('reason')
-                    }
+                # Expired punishments are kept too - the sweeper lifts them straight away
+                active_punishments[user_id] = {
+                    'type': doc.get('type'),
+                    'until': until_date,
+                    'reason': doc.get('reason'),
+                    'guild_id': doc.get('guild_id')
+                }
 
-                    # Reschedule the punishment end
-                    remaining_seconds = (until_date - datetime.utcnow()).total_seconds()
-                    if doc.get('type') == 'mute':
-                        asyncio.create_task(schedule_unmute(user_id, None, remaining_seconds))
-                    elif doc.get('type') == 'tempban':
-                        asyncio.create_task(schedule_unban(user_id, None, remaining_seconds))
+                # Reschedule the punishment end
+                schedule_punishment_expiry(user_id, until_date)
 
-            # Load active giveaways
+            # Load giveaways that haven't ended - end_time is stored as an ISO string, which sorts chronologically
             giveaways_collection = db['giveaways']
-            giveaways_docs = list(giveaways_collection.find({'type_doc': 'giveaways'}))
-            for doc in giveaways_docs:
+            now_iso = datetime.utcnow().isoformat()
+            upcoming_docs = list(giveaways_collection.find({'ended': False, 'end_time': {'$gt': now_iso}, 'type_doc': 'giveaways'}))
+            overdue_docs = list(giveaways_collection.find({'ended': False, 'end_time': {'$lte': now_iso}, 'type_doc': 'giveaways'}))
+            for doc in upcoming_docs + overdue_docs:
                 msg_id = doc['_id']
 
                 # Handle datetime conversion - it might be stored as ISO string
@@ -437,29 +520,30 @@ async def load_data():
                 else:
                     end_time = end_time_raw
 
-                # Only load if giveaway hasn't ended
-                if not doc.get('ended', False) and end_time > datetime.utcnow():
-                    # Convert ObjectId to regular values if needed
-                    giveaway_data = {k: v for k, v in doc.items() if k != '_id'}
-
-                    # Convert any datetime strings back to datetime objects
-                    for key, value in giveaway_data.items():
-                        if isinstance(value, str):
-                            try:
-                                # Try to parse as datetime if it looks like an ISO format
-                                if 'T' in value and ('+' in value or value.endswith('Z')):
-                                    giveaway_data[key] = datetime.fromisoformat(value.replace('Z', '+00:00'))
-                            except ValueError:
-                                # If it's not a datetime string, leave it as is
-                                pass
-
-                    giveaway_data['message_id'] = doc.get('message_id', msg_id)
-                    giveaway_data['end_time'] = end_time
-                    active_giveaways[msg_id] = giveaway_data
-
+                # Convert ObjectId to regular values if needed
+                giveaway_data = {k: v for k, v in doc.items() if k != '_id'}
+
+                # Convert any datetime strings back to datetime objects
+                for key, value in giveaway_data.items():
+                    if isinstance(value, str):
+                        try:
+                            # Try to parse as datetime if it looks like an ISO format
+                            if 'T' in value and ('+' in value or value.endswith('Z')):
+                                giveaway_data[key] = datetime.fromisoformat(value.replace('Z', '+00:00'))
+                        except ValueError:
+                            # If it's not a datetime string, leave it as is
+                            pass
+
+                giveaway_data['message_id'] = doc.get('message_id', msg_id)
+                giveaway_data['end_time'] = end_time
+                load_giveaway_entries(msg_id, giveaway_data)
+                register_giveaway(msg_id, giveaway_data)
+
+                if end_time > datetime.utcnow():
                     # Reschedule giveaway end
-                    remaining_seconds = (end_time - datetime.utcnow()).total_seconds()
-                    asyncio.create_task(end_giveaway_after_delay(msg_id, remaining_seconds))
+                    schedule_giveaway_end(msg_id, end_time)
+                else:
+                    overdue_giveaways.append(msg_id)
 
             # Load invite data
             invites_collection = db['invites']
@@ -484,6 +568,13 @@ async def load_data():
                     'last_message_date': doc.get('last_message_date')
                 }
 
+            # Load server settings
+            settings_collection = db['settings']
+            for doc in settings_collection.find({'type': 'settings'}):
+                guild_settings[doc['_id']] = {k: v for k, v in doc.items() if k not in ('_id', 'type')}
+
+            start_giveaway_catch_up(overdue_giveaways)
+
             logging.info(f"✅ Loaded data from MongoDB - {len(user_levels)} users, {len(user_warnings)} warnings, {len(active_punishments)} punishments, {len(active_giveaways)} giveaways, {len(invite_counts)} invite records, {len(message_counts)} message records")
         except Exception as e:
             logging.error(f"Error loading from MongoDB: {e}")
@@ -534,20 +625,16 @@ async def load_data():
                         user_id = int(user_id_str)
                         until_date = datetime.fromisoformat(punishment_data['until'])
 
-                        # Only load if punishment hasn't expired
-                        if until_date > datetime.utcnow():
-                            active_punishments[user_id] = {
-                                'type': punishment_data['type'],
-                                'until': until_date,
-                                'reason': punishment_data['reason']
-                            }
+                        # Expired punishments are kept too - the sweeper lifts them straight away
+                        active_punishments[user_id] = {
+                            'type': punishment_data['type'],
+                            'until': until_date,
+                            'reason': punishment_data['reason'],
+                            'guild_id': punishment_data.get('guild_id')
+                        }
 
-                            # Reschedule the punishment end
-                            remaining_seconds = (until_date - datetime.utcnow()).total_seconds()
-                            if punishment_data['type'] == 'mute':
-                                asyncio.create_task(schedule_unmute(user_id, None, remaining_seconds))
-                            elif punishment_data['type'] == 'tempban':
-                                asyncio.create_task(schedule_unban(user_id, None, remaining_seconds))
+                        # Reschedule the punishment end
+                        schedule_punishment_expiry(user_id, until_date)
 
         # Load giveaways
         if os.path.exists(GIVEAWAYS_FILE):
@@ -555,19 +642,25 @@ async def load_data():
                 file_content = f.read().strip()
                 if file_content:
                     data = json.loads(file_content)
-                    active_giveaways = {}
+                    active_giveaways.clear()
+                    giveaway_index.clear()
                     for msg_id_str, giveaway_data in data.items():
                         msg_id = int(msg_id_str)
                         end_time = datetime.fromisoformat(giveaway_data['end_time'])
+                        giveaway_data['end_time'] = end_time
+
+                        # Ended giveaways stay loaded for rerolls until they're archived
+                        load_giveaway_entries(msg_id, giveaway_data)
+                        register_giveaway(msg_id, giveaway_data)
 
-                        # Only load if giveaway hasn't ended
-                        if not giveaway_data.get('ended', False) and end_time > datetime.utcnow():
-                            giveaway_data['end_time'] = end_time
-                            active_giveaways[msg_id] = giveaway_data
+                        if not giveaway_data.get('ended', False):
+                            if end_time > datetime.utcnow():
+                                # Reschedule giveaway end
+                                schedule_giveaway_end(msg_id, end_time)
+                            else:
+                                overdue_giveaways.append(msg_id)
 
-                            # Reschedule giveaway end
-                            remaining_seconds = (end_time - datetime.utcnow()).total_seconds()
-                            asyncio.create_task(end_giveaway_after_delay(msg_id, remaining_seconds))
+                    start_giveaway_catch_up(overdue_giveaways)
 
         # Load invites
         if os.path.exists(INVITES_FILE):
@@ -600,6 +693,16 @@ async def load_data():
                             'last_message_date': message_data.get('last_message_date')
                         }
 
+        # Load server settings
+        if os.path.exists(SETTINGS_FILE):
+            with open(SETTINGS_FILE, 'r') as f:
+                file_content = f.read().strip()
+                if file_content:
+                    data = json.loads(file_content)
+                    guild_settings.clear()
+                    for guild_id_str, settings_data in data.items():
+                        guild_settings[int(guild_id_str)] = settings_data
+
     except Exception as e:
         logging.error(f"Error loading data: {e}")
 
@@ -614,10 +717,9 @@ async def assign_level_perk_roles(member: discord.Member, new_level: int, old_le
                     roles_to_add.append(role)
 
         if roles_to_add:
-            await member.add_roles(*roles_to_add, reason=f"Level perk roles for reaching level {new_level}")
+            # Queued rather than awaited - perks wait behind moderation and failures are logged by the queue
+            queue_role_change(member, add=roles_to_add, reason=f"Level perk roles for reaching level {new_level}")
 
-    except discord.Forbidden:
-        logging.error(f"Missing permissions to assign roles to {member}")
     except Exception as e:
         logging.error(f"Error assigning level perk roles: {e}")
 
@@ -716,6 +818,104 @@ def check_message_requirements(member, min_messages=100):
 
     return meets_requirement, user_messages, min_messages
 
+def draw_weighted_winners(entries, count, is_valid=None):
+    """Draw up to count distinct members from (member, weight) pairs, each weighted by their entries
+
+    Uses Efraimidis-Spirakis keys (u ** (1 / weight), compared as logs), so a member with weight 5 is as
+    likely to win as five separate entries without building a list of every entry. Members failing
+    is_valid are skipped and the next key is taken instead.
+    """
+    keyed_entries = [
+        (-math.log(1.0 - random.random()) / weight, index, member)  # smaller is better
+        for index, (member, weight) in enumerate(entries)
+        if weight > 0
+    ]
+
+    if is_valid is None:
+        return [member for _, _, member in heapq.nsmallest(count, keyed_entries)]
+
+    heapq.heapify(keyed_entries)
+    winners = []
+    while keyed_entries and len(winners) < count:
+        _, _, member = heapq.heappop(keyed_entries)
+        if is_valid(member):
+            winners.append(member)
+    return winners
+
+def get_giveaway_role_ids(giveaway, guild):
+    """Get a giveaway's required and blacklisted role IDs, migrating records that stored role names"""
+    for key in ('required_role', 'blacklisted_role'):
+        if f'{key}_id' not in giveaway:
+            role_name = (giveaway.get(key) or '').replace('@', '').replace('<', '').replace('>', '')
+            role = discord.utils.get(guild.roles, name=role_name) if role_name else None
+            giveaway[f'{key}_id'] = role.id if role else None
+            giveaway.pop(key, None)
+
+    return giveaway['required_role_id'], giveaway['blacklisted_role_id']
+
+def compile_giveaway_eligibility(giveaway, guild):
+    """Resolve a giveaway's rules once and return a function giving a member's entry weight (0 if not eligible)"""
+    required_role_id, blacklisted_role_id = get_giveaway_role_ids(giveaway, guild)
+
+    # Rules for roles that have since been deleted don't apply
+    if required_role_id and not guild.get_role(required_role_id):
+        required_role_id = None
+    if blacklisted_role_id and not guild.get_role(blacklisted_role_id):
+        blacklisted_role_id = None
+
+    rig_winner = giveaway.get('rig_winner')
+
+    def get_entry_weight(member):
+        if not member or member.bot:
+            return 0
+
+        # Member.get_role looks the ID up in the member's sorted role IDs
+        if required_role_id and not member.get_role(required_role_id):
+            return 0
+        if blacklisted_role_id and member.get_role(blacklisted_role_id):
+            return 0
+
+        # Check message requirements (default 100 messages) - the rigged winner bypasses them
+        if not (rig_winner and member.id == rig_winner):
+            meets_req, user_messages, req_amount = check_message_requirements(member, 100)
+            if not meets_req:
+                return 0
+
+        return get_giveaway_entry_multiplier(member)
+
+    return get_entry_weight
+
+def build_giveaway_pool(entrants, guild, get_entry_weight):
+    """Turn tracked entrants into (member, weight) pairs for the draw, skipping members who left"""
+    pool = []
+    for user_id_str, weight in entrants.items():
+        member = guild.get_member(int(user_id_str))
+        if not member:
+            continue
+
+        # Entrants who weren't eligible when they reacted may have become eligible since
+        if not weight:
+            weight = get_entry_weight(member)
+            if not weight:
+                continue
+
+        pool.append((member, weight))
+    return pool
+
+def snapshot_giveaway_draw(eligible_users, winners):
+    """Record a draw's pool as member IDs and weights plus who has won, so rerolls can draw without the API"""
+    return {
+        'ids': [member.id for member, _ in eligible_users],
+        'weights': [weight for _, weight in eligible_users],
+        'won': [winner.id for winner in winners]
+    }
+
+def get_giveaway_entry_weight(giveaway, member):
+    """Get how many entries a member has in a giveaway, or 0 if they aren't eligible"""
+    if not member:
+        return 0
+    return compile_giveaway_eligibility(giveaway, member.guild)(member)
+
 async def add_xp(user_id, base_xp, member):
     """Add XP to a user with level and booster multipliers - thread safe"""
     global user_levels, xp_locks
@@ -736,6 +936,7 @@ async def add_xp(user_id, base_xp, member):
 
             user_levels[user_id]['xp'] += xp_gained
             user_levels[user_id]['last_message'] = datetime.utcnow()
+            invalidate_leaderboard('levels', user_id, {None: user_levels[user_id]['xp']})
 
             # Check for level up
             current_xp = user_levels[user_id]['xp']
@@ -762,172 +963,184 @@ async def add_xp(user_id, base_xp, member):
         except Exception as e:
             logging.error(f"Error adding XP to user {user_id}: {e}")
 
-def generate_rank_card(member, level, current_xp, xp_for_current, xp_for_next, rank_position, guild_icon_url):
-    """Generate a beautiful rank card image"""
-    # Create image with more compact dimensions
-    width, height = 700, 250
-    card = Image.new('RGB', (width, height))
-    draw = ImageDraw.Draw(card)
-
-    # Create a more colorful background
-    # Draw a gradient background from top to bottom
-    for y in range(height):
-        # Create a gradient from dark blue to lighter blue/purple
-        r = int(25 + (y / height) * 30)
-        g = int(30 + (y / height) * 35)
-        b = int(40 + (y / height) * 60)
-        draw.line([(0, y), (width, y)], fill=(r, g, b))
-
-    # Draw a decorative background element
-    draw.rectangle([0, 0, width, 30], fill=(70, 80, 150, 180))  # Top banner
-    draw.rectangle([0, height-30, width, height], fill=(70, 80, 150, 180))  # Bottom banner
-
-    # Try to load fonts (fall back to default if not available)
-    try:
-        name_font = ImageFont.truetype("arial.ttf", 30)
-        level_font = ImageFont.truetype("arial.ttf", 40)
-        stat_font = ImageFont.truetype("arial.ttf", 16)
-        small_stat_font = ImageFont.truetype("arial.ttf", 14)
-    except:
-        name_font = ImageFont.load_default()
-        level_font = ImageFont.load_default()
-        stat_font = ImageFont.load_default()
-        small_stat_font = ImageFont.load_default()
-
-    # Draw user avatar (circle)
-    try:
-        avatar_response = requests.get(member.display_avatar.url)
-        avatar = Image.open(BytesIO(avatar_response.content)).convert('RGBA')
-        avatar_size = 100
-        avatar = avatar.resize((avatar_size, avatar_size), Image.Resampling.LANCZOS)
-
-        # Create circular mask
-        mask = Image.new('L', (avatar_size, avatar_size), 0)
-        mask_draw = ImageDraw.Draw(mask)
-        mask_draw.ellipse([0, 0, avatar_size, avatar_size], fill=255)
-
-        # Create a colorful border for the avatar
-        border_radius = 55
-        border_center_x, border_center_y = 77, 80  # Center of avatar position
-        draw.ellipse([border_center_x - border_radius, border_center_y - border_radius,
-                      border_center_x + border_radius, border_center_y + border_radius],
-                     outline=(255, 215, 0), width=4)  # Gold border
-
-        # Paste avatar
-        card.paste(avatar, (27, 30), mask)
-    except:
-        pass
-
-    # Draw username with shadow effect
-    username = member.name[:20]
-    draw.text((140, 35), username, font=name_font, fill=(255, 255, 255))
-    # Add shadow
-    draw.text((141, 36), username, font=name_font, fill=(0, 0, 0, 128))
-
-    # Draw level badge with gradient background
-    level_bg_top = (88, 101, 242)  # Discord blurple
-    level_bg_bottom = (155, 89, 182)  # Purple
-    # Draw gradient rectangle for level badge
-    for y in range(30, 80):
-        gradient_factor = (y - 30) / (80 - 30)
-        r = int(level_bg_top[0] + (level_bg_bottom[0] - level_bg_top[0]) * gradient_factor)
-        g = int(level_bg_top[1] + (level_bg_bottom[1] - level_bg_top[1]) * gradient_factor)
-        b = int(level_bg_top[2] + (level_bg_bottom[2] - level_bg_top[2]) * gradient_factor)
-        draw.line([(550, y), (670, y)], fill=(r, g, b))
-
-    # Draw rounded corners for level badge
-    draw.rounded_rectangle([550, 30, 670, 80], radius=15, fill=None, outline=(255, 255, 255), width=2)
-    draw.text((595, 40), f"LVL {level}", font=level_font, fill=(255, 255, 255))
-
-    # Draw rank position with gold color
-    rank_text = f"#{rank_position}"
-    draw.text((140, 75), f"Rank: {rank_text}", font=stat_font, fill=(255, 215, 0))  # Gold color
-
-    # Draw XP bar with gradient background
-    bar_width = 500
-    bar_height = 25
-    bar_x = 140
-    bar_y = 120
-
-    # Draw gradient background bar
-    for x in range(bar_width):
-        gradient_pos = x / bar_width
-        r = int(60 + gradient_pos * 40)
-        g = int(60 + gradient_pos * 30)
-        b = int(80 + gradient_pos * 20)
-        draw.line([(bar_x + x, bar_y), (bar_x + x, bar_y + bar_height)], fill=(r, g, b))
-
-    # Draw XP progress with colorful gradient
-    xp_in_level = current_xp - xp_for_current
-    xp_needed = xp_for_next - xp_for_current
-    progress_width = int((xp_in_level / xp_needed) * bar_width) if xp_needed > 0 else 0
-
-    if progress_width > 0:
-        # Draw progress with rainbow-like gradient
-        for i in range(progress_width):
-            # Create a rainbow gradient
-            hue_pos = (i / progress_width) * 6
-            if hue_pos < 1:  # Red to yellow
-                r, g, b = 255, int(255 * hue_pos), 0
-            elif hue_pos < 2:  # Yellow to green
-                r, g, b = int(255 * (2 - hue_pos)), 255, 0
-            elif hue_pos < 3:  # Green to cyan
-                r, g, b = 0, 255, int(255 * (hue_pos - 2))
-            elif hue_pos < 4:  # Cyan to blue
-                r, g, b = 0, int(255 * (4 - hue_pos)), 255
-            elif hue_pos < 5:  # Blue to magenta
-                r, g, b = int(255 * (hue_pos - 4)), 0, 255
-            else:  # Magenta to red
-                r, g, b = 255, 0, int(255 * (6 - hue_pos))
-
-            draw.line([(bar_x + i, bar_y), (bar_x + i, bar_y + bar_height)], fill=(int(r), int(g), int(b)))
-
-    # Draw border around XP bar
-    draw.rounded_rectangle([bar_x, bar_y, bar_x + bar_width, bar_y + bar_height], radius=12, outline=(255, 255, 255), width=2)
-
-    # XP text overlay (centered in the progress bar)
-    xp_text = f"{xp_in_level:,} / {xp_needed:,} XP"
-    text_bbox = draw.textbbox((0, 0), xp_text, font=small_stat_font)
-    text_width = text_bbox[2] - text_bbox[0]
-    text_x = bar_x + (bar_width - text_width) // 2
-    draw.text((text_x, bar_y + 5), xp_text, font=small_stat_font, fill=(255, 255, 255))
-
-    # Draw total XP
-    total_xp_text = f"Total XP: {current_xp:,}"
-    draw.text((140, 160), total_xp_text, font=stat_font, fill=(200, 230, 255))  # Light blue
-
-    # Draw server icon with circular frame
+# Rank card asset cache
+RANK_CARD_AVATAR_SIZE = 100
+RANK_CARD_ICON_SIZE = 60
+RANK_CARD_ASSET_CACHE_SIZE = 256  # decoded images kept in memory
+rank_card_asset_cache = OrderedDict()  # {(asset_key, size): circular RGBA image}
+
+def get_asset_fetch_size(size):
+    """Get the smallest size variant Discord serves that is at least size pixels"""
+    fetch_size = 16
+    while fetch_size < size and fetch_size < 4096:
+        fetch_size *= 2
+    return fetch_size
+
+async def fetch_rank_card_asset(asset, size):
+    """Fetch an avatar or icon asset at a small size and return it pre-masked, using the LRU cache"""
+    if asset is None:
+        return None
+
+    cache_key = (asset.key, size)
+    cached_image = rank_card_asset_cache.get(cache_key)
+    if cached_image is not None:
+        rank_card_asset_cache.move_to_end(cache_key)
+        return cached_image
+
     try:
-        logo_response = requests.get(guild_icon_url)
-        logo = Image.open(BytesIO(logo_response.content)).convert('RGBA')
-        logo_size = 60
-        logo = logo.resize((logo_size, logo_size), Image.Resampling.LANCZOS)
+        # Ask the CDN for the small variant instead of downloading the full-size asset
+        asset_bytes = await asset.with_size(get_asset_fetch_size(size)).read()
+        image = mask_circle(Image.open(BytesIO(asset_bytes)), size)
+    except (discord.DiscordException, OSError, ValueError) as e:
+        logging.warning(f"Could not fetch rank card asset {asset.key}: {e}")
+        return None
+
+    rank_card_asset_cache[cache_key] = image
+    while len(rank_card_asset_cache) > RANK_CARD_ASSET_CACHE_SIZE:
+        rank_card_asset_cache.popitem(last=False)
+
+    return image
+
+# Rank card encoding - PNG by default, servers on slow links can pick a smaller format or a byte budget
+RANK_CARD_DEFAULT_FORMAT = 'png'
+render_metrics = {}  # {(card type, format): {'count': int, 'encode_seconds': float, 'bytes': int, 'last_bytes': int}}
+
+def get_rank_card_encoding(guild_id):
+    """Get a server's card format and byte budget"""
+    settings = guild_settings.get(guild_id, {})
+    image_format = settings.get('rank_card_format', RANK_CARD_DEFAULT_FORMAT)
+    if image_format not in IMAGE_FORMATS:
+        image_format = RANK_CARD_DEFAULT_FORMAT
+    return image_format, settings.get('rank_card_max_bytes')
+
+def record_render_metrics(card_type, encoded):
+    """Add an encoded card's encode time and size to the metrics"""
+    metrics = render_metrics.setdefault((card_type, encoded.image_format), {'count': 0, 'encode_seconds': 0.0, 'bytes': 0, 'last_bytes': 0})
+    metrics['count'] += 1
+    metrics['encode_seconds'] += encoded.encode_seconds
+    metrics['bytes'] += len(encoded.data)
+    metrics['last_bytes'] = len(encoded.data)
+
+# Rendered rank card cache - repeat /rankcard calls with nothing visibly changed reuse the encoded card
+RANK_CARD_OUTPUT_CACHE_BYTES = 16 * 1024 * 1024  # byte budget for cached cards
+rank_card_output_cache = OrderedDict()  # {visual state key: EncodedImage}
+rank_card_output_cache_bytes = 0
+
+def get_rank_card_cache_key(member, guild, level, current_xp, xp_for_current, xp_for_next, rank_position, theme='default',
+                            image_format=RANK_CARD_DEFAULT_FORMAT, max_bytes=None):
+    """Build a key out of everything that affects a rank card's bytes"""
+    return (
+        member.id,
+        member.display_avatar.key,
+        member.name,
+        level,
+        get_progress_width(current_xp, xp_for_current, xp_for_next),
+        current_xp,  # the XP numbers are printed on the card too
+        rank_position,
+        guild.icon.key if guild.icon else None,
+        theme,
+        image_format,
+        max_bytes
+    )
+
+def get_cached_rank_card(cache_key):
+    """Get a cached encoded rank card, if any"""
+    card = rank_card_output_cache.get(cache_key)
+    if card is not None:
+        rank_card_output_cache.move_to_end(cache_key)
+    return card
+
+def cache_rank_card(cache_key, card):
+    """Cache an encoded card, evicting the least recently used cards past the byte budget"""
+    global rank_card_output_cache_bytes
 
-        # Create circular mask for server icon
-        logo_mask = Image.new('L', (logo_size, logo_size), 0)
-        logo_mask_draw = ImageDraw.Draw(logo_mask)
-        logo_mask_draw.ellipse([0, 0, logo_size, logo_size], fill=255)
+    if len(card.data) > RANK_CARD_OUTPUT_CACHE_BYTES:
+        return
+
+    old_card = rank_card_output_cache.pop(cache_key, None)
+    if old_card is not None:
+        rank_card_output_cache_bytes -= len(old_card.data)
+
+    rank_card_output_cache[cache_key] = card
+    rank_card_output_cache_bytes += len(card.data)
+
+    while rank_card_output_cache_bytes > RANK_CARD_OUTPUT_CACHE_BYTES:
+        _, evicted_card = rank_card_output_cache.popitem(last=False)
+        rank_card_output_cache_bytes -= len(evicted_card.data)
+
+# Render process pool - Pillow work is CPU-bound and would otherwise stall the gateway
+RENDER_POOL_WORKERS = max(1, min(2, os.cpu_count() or 1))
+RENDER_QUEUE_LIMIT = 8  # render jobs running or waiting before new ones are turned away
+RENDER_TIMEOUT = 15  # seconds
+render_pool = None
+render_jobs_pending = 0
+rank_card_font_path = None  # found once at startup - replacement render workers are handed it instead of searching
+
+def start_render_pool():
+    """Fork the render workers - only safe while this is the process's only thread, so it runs first at startup"""
+    global render_pool
+    render_pool = ProcessPoolExecutor(max_workers=RENDER_POOL_WORKERS, mp_context=multiprocessing.get_context('fork'))
+    # A fork pool launches every worker on its first job, so they're all forked before this returns
+    render_pool.submit(discover_rank_card_font).result()
+
+def get_render_pool():
+    """Get the render process pool, replacing a broken one with spawned workers"""
+    global render_pool
+    if render_pool is None:
+        # Forking now would copy a process that has threads running. Spawned workers start a fresh interpreter
+        # instead - they re-import this file as __mp_main__, which defines the bot but skips the startup block
+        render_pool = ProcessPoolExecutor(
+            max_workers=RENDER_POOL_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_render_worker,
+            initargs=(rank_card_font_path,)
+        )
+    return render_pool
 
-        # Create a frame for the server icon
-        icon_frame_x, icon_frame_y = width - 80, height - 80
-        draw.ellipse([icon_frame_x - 5, icon_frame_y - 5,
-                      icon_frame_x + logo_size + 5, icon_frame_y + logo_size + 5],
-                     outline=(255, 215, 0), width=3)  # Gold frame
+def reset_render_pool():
+    """Shut down a broken render pool so the next job gets a new one"""
+    global render_pool
+    if render_pool is not None:
+        render_pool.shutdown(wait=False, cancel_futures=True)
+        render_pool = None
 
-        # Paste server icon
-        card.paste(logo, (icon_frame_x, icon_frame_y), logo_mask)
-    except:
-        pass
+def render_job_finished(_future):
+    """Release a render queue slot once the worker is actually done with the job"""
+    global render_jobs_pending
+    render_jobs_pending -= 1
 
-    # Add a subtle outer border
-    draw.rectangle([0, 0, width-1, height-1], outline=(100, 150, 255), width=3)
+async def run_render_job(render_func, request):
+    """Run a render function in the process pool
 
-    # Save to bytes
-    img_bytes = BytesIO()
-    card.save(img_bytes, format='PNG')
-    img_bytes.seek(0)
+    Returns None instead of the rendered bytes if the queue is full, the job times out or the pool broke.
+    """
+    global render_jobs_pending
 
-    return img_bytes
+    if render_jobs_pending >= RENDER_QUEUE_LIMIT:
+        logging.warning(f"Render pool saturated ({render_jobs_pending} jobs pending), turning away job")
+        return None
+
+    loop = asyncio.get_running_loop()
+    try:
+        job = get_render_pool().submit(render_func, request)
+    except BrokenProcessPool:
+        logging.error("Render pool is broken, restarting it")
+        reset_render_pool()
+        return None
+
+    # Count the slot until the worker finishes, even if we stop waiting on it earlier
+    render_jobs_pending += 1
+    job.add_done_callback(lambda future: loop.call_soon_threadsafe(render_job_finished, future))
+
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(job), RENDER_TIMEOUT)
+    except asyncio.TimeoutError:
+        logging.error(f"Render job timed out after {RENDER_TIMEOUT}s")
+        return None
+    except BrokenProcessPool:
+        logging.error("Render pool worker died, restarting the pool")
+        reset_render_pool()
+        return None
 
 # Anti-Spam Configuration
 spam_cache = {}  # {user_id: {'messages': [], 'warnings': int}}
@@ -936,6 +1149,47 @@ SPAM_TIME_WINDOW = 10  # seconds
 CAPS_THRESHOLD = 0.75  # 75% caps
 MIN_CHARS_FOR_CAPS_CHECK = 10
 
+# Spam deletion - flagged messages are collected per channel and removed with bulk deletes
+SPAM_DELETE_WINDOW = 1.0  # seconds to collect flagged messages before deleting
+BULK_DELETE_LIMIT = 100  # messages per bulk delete
+BULK_DELETE_MAX_AGE = timedelta(days=14)  # Discord won't bulk delete anything older
+spam_delete_batches = {}  # {channel_id: set of message IDs waiting to be deleted}
+
+def queue_spam_deletion(channel, message_ids):
+    """Flag messages for deletion, starting a batch for the channel if one isn't already collecting"""
+    batch = spam_delete_batches.get(channel.id)
+    if batch is None:
+        batch = spam_delete_batches[channel.id] = set()
+        start_background_task(flush_spam_deletions(channel))
+    batch.update(message_ids)
+
+async def flush_spam_deletions(channel):
+    """Wait out the batch window, then delete everything flagged in the channel in as few calls as possible"""
+    await asyncio.sleep(SPAM_DELETE_WINDOW)
+    message_ids = sorted(spam_delete_batches.pop(channel.id, ()))
+
+    cutoff = discord.utils.utcnow() - BULK_DELETE_MAX_AGE
+    recent_ids = [message_id for message_id in message_ids if discord.utils.snowflake_time(message_id) > cutoff]
+    old_ids = [message_id for message_id in message_ids if discord.utils.snowflake_time(message_id) <= cutoff]
+
+    try:
+        for start in range(0, len(recent_ids), BULK_DELETE_LIMIT):
+            chunk = recent_ids[start:start + BULK_DELETE_LIMIT]
+            if len(chunk) == 1:
+                old_ids.append(chunk[0])  # Bulk delete needs at least two messages
+                continue
+            await channel.delete_messages([discord.Object(id=message_id) for message_id in chunk], reason="Spam")
+
+        for message_id in old_ids:
+            try:
+                await channel.get_partial_message(message_id).delete()
+            except discord.NotFound:
+                pass  # Already deleted
+    except discord.Forbidden:
+        logging.error(f"No permission to delete spam in #{channel}")
+    except discord.HTTPException as e:
+        logging.error(f"Error deleting {len(message_ids)} spam message(s) in #{channel}: {e}")
+
 def get_level_progress(user_id, member):
     """Get user's level progress information, including booster bonuses"""
     global user_levels
@@ -999,6 +1253,38 @@ def uptime():
         'timestamp': time.time()
     }, 200
 
+@app.route('/metrics')
+def metrics():
+    return {
+        'rank_cards': [
+            {
+                'card': card_type,
+                'format': image_format,
+                'count': data['count'],
+                'avg_encode_ms': round(data['encode_seconds'] / data['count'] * 1000, 2),
+                'avg_bytes': data['bytes'] // data['count'],
+                'last_bytes': data['last_bytes']
+            }
+            for (card_type, image_format), data in list(render_metrics.items())
+        ],
+        'rank_card_cache_bytes': rank_card_output_cache_bytes,
+        'render_jobs_pending': render_jobs_pending,
+        'role_changes': {
+            **role_change_metrics,
+            # Changes not applied yet - waiting in the queue, held back behind the same member's, or being applied
+            'pending': {
+                name: sum(
+                    1 for change in [*pending_role_changes.values(), *role_changes_in_flight.values()]
+                    if change['priority'] == priority
+                )
+                for priority, name in ROLE_PRIORITY_NAMES.items()
+            },
+            'deferred': len(role_changes_deferred),
+            'in_flight': len(role_changes_in_flight)
+        },
+        'timestamp': time.time()
+    }, 200
+
 def run():
     app.run(host='0.0.0.0', port=5000)
 
@@ -1022,6 +1308,11 @@ async def on_ready():
 
     # Load data on startup
     await load_data()
+    start_giveaway_archiver()
+
+    # Invites may have been created or used while disconnected
+    start_background_task(warm_invite_cache(bot.guilds))
+    start_invite_refresher()
 
     try:
         synced = await bot.tree.sync()
@@ -1202,16 +1493,18 @@ async def giveaway_slash(
         'winners': winners,
         'host': host_mention,
         'end_time': end_time,
-        'required_role': required_role.name if required_role else '',
-        'blacklisted_role': blacklisted_role.name if blacklisted_role else '',
+        'required_role_id': required_role.id if required_role else None,
+        'blacklisted_role_id': blacklisted_role.id if blacklisted_role else None,
         'rig_winner': rig_user_id,
+        'entrants': {},  # {str(user_id): entry weight, 0 if not eligible when they entered}
         'ended': False
     }
 
-    active_giveaways[giveaway_msg.id] = giveaway_data
+    register_giveaway(giveaway_msg.id, giveaway_data)
+    write_giveaway_entrants(giveaway_msg.id, {})
 
     # Schedule giveaway end
-    asyncio.create_task(end_giveaway_after_delay(giveaway_msg.id, parsed_duration.total_seconds()))
+    schedule_giveaway_end(giveaway_msg.id, end_time)
 
     # Save data
     save_data()
@@ -1221,6 +1514,411 @@ async def giveaway_slash(
 
     await interaction.response.send_message(success_msg, ephemeral=True)
 
+# Giveaway entries - entrants and draw snapshots live outside the giveaway records, so the frequent save_data calls
+# don't rewrite them. Entrant changes are queued and written when data is saved: $set/$unset per entrant on MongoDB,
+# an append-only log on JSON. A draw snapshot is written once when the draw happens and replaces the entrants
+GIVEAWAY_ENTRIES_DIR = f"{DATA_DIR}/giveaway_entries"
+GIVEAWAY_SEPARATE_FIELDS = ('entrants', 'draw_snapshot')
+pending_entrant_changes = {}  # {giveaway_id: {str(user_id): weight, or None if they took their entry back}}
+giveaways_needing_resync = set()  # loaded from storage, so reactions may have changed while the bot was offline
+
+def get_giveaway_record(giveaway):
+    """Get the fields saved in a giveaway's own record"""
+    return {key: value for key, value in giveaway.items() if key not in GIVEAWAY_SEPARATE_FIELDS}
+
+def get_entrants_log_path(giveaway_id):
+    """Path of a giveaway's entrant log when using JSON storage"""
+    return f"{GIVEAWAY_ENTRIES_DIR}/{giveaway_id}.jsonl"
+
+def record_giveaway_entrant(giveaway_id, user_id_str, weight):
+    """Queue an entrant change (weight None to remove them) for the next save"""
+    pending_entrant_changes.setdefault(giveaway_id, {})[user_id_str] = weight
+
+def flush_giveaway_entrants():
+    """Write queued entrant changes, leaving any that fail queued for the next save"""
+    for giveaway_id, changes in list(pending_entrant_changes.items()):
+        try:
+            if mongo_client:
+                update = {}
+                added = {f'entrants.{user_id_str}': weight for user_id_str, weight in changes.items() if weight is not None}
+                removed = {f'entrants.{user_id_str}': '' for user_id_str, weight in changes.items() if weight is None}
+                if added:
+                    update['$set'] = added
+                if removed:
+                    update['$unset'] = removed
+                giveaway_entries_collection.update_one({'_id': giveaway_id}, update, upsert=True)
+            else:
+                os.makedirs(GIVEAWAY_ENTRIES_DIR, exist_ok=True)
+                with open(get_entrants_log_path(giveaway_id), 'a') as f:
+                    f.write(json.dumps(changes) + '\n')
+        except Exception as e:
+            logging.error(f"Error saving entrants for giveaway {giveaway_id}: {e}")
+            continue
+        del pending_entrant_changes[giveaway_id]
+
+def write_giveaway_entrants(giveaway_id, entrants):
+    """Replace a giveaway's stored entrants in one write, e.g. when it's created or resynced"""
+    pending_entrant_changes.pop(giveaway_id, None)
+    try:
+        if mongo_client:
+            giveaway_entries_collection.update_one({'_id': giveaway_id}, {'$set': {'entrants': entrants}}, upsert=True)
+        else:
+            os.makedirs(GIVEAWAY_ENTRIES_DIR, exist_ok=True)
+            with open(get_entrants_log_path(giveaway_id), 'w') as f:
+                f.write(json.dumps(entrants) + '\n')
+    except Exception as e:
+        logging.error(f"Error saving entrants for giveaway {giveaway_id}: {e}")
+
+def get_draw_snapshot_path(giveaway_id):
+    """Path of a giveaway's draw snapshot when using JSON storage"""
+    return f"{GIVEAWAY_ENTRIES_DIR}/{giveaway_id}.snapshot.json"
+
+def write_draw_snapshot(giveaway_id, snapshot):
+    """Store a giveaway's draw snapshot in place of its entrants - once per draw, not on every save"""
+    pending_entrant_changes.pop(giveaway_id, None)
+    try:
+        if mongo_client:
+            giveaway_entries_collection.update_one(
+                {'_id': giveaway_id},
+                {'$set': {'draw_snapshot': snapshot}, '$unset': {'entrants': ''}},
+                upsert=True
+            )
+        else:
+            os.makedirs(GIVEAWAY_ENTRIES_DIR, exist_ok=True)
+            with open(get_draw_snapshot_path(giveaway_id), 'w') as f:
+                json.dump(snapshot, f)
+            if os.path.exists(get_entrants_log_path(giveaway_id)):
+                os.remove(get_entrants_log_path(giveaway_id))
+    except Exception as e:
+        logging.error(f"Error saving draw snapshot for giveaway {giveaway_id}: {e}")
+
+def load_giveaway_entries(giveaway_id, giveaway):
+    """Attach a giveaway's stored entrants and draw snapshot, moving any saved inside its record to their own storage"""
+    stored = {}
+    try:
+        if mongo_client:
+            stored = giveaway_entries_collection.find_one({'_id': giveaway_id}) or {}
+        elif os.path.exists(get_entrants_log_path(giveaway_id)):
+            # Replay the log - each line is a batch of changes, the first is usually the full list
+            entrants = {}
+            with open(get_entrants_log_path(giveaway_id), 'r') as f:
+                for line in f:
+                    if line.strip():
+                        entrants.update(json.loads(line))
+            stored['entrants'] = {user_id_str: weight for user_id_str, weight in entrants.items() if weight is not None}
+        if not mongo_client and os.path.exists(get_draw_snapshot_path(giveaway_id)):
+            with open(get_draw_snapshot_path(giveaway_id), 'r') as f:
+                stored['draw_snapshot'] = json.load(f)
+    except Exception as e:
+        logging.error(f"Error loading entrants for giveaway {giveaway_id}: {e}")
+        return
+
+    if 'entrants' in stored:
+        giveaway['entrants'] = stored['entrants']
+        if not mongo_client:
+            write_giveaway_entrants(giveaway_id, stored['entrants'])  # Compact the log
+    elif 'entrants' in giveaway:
+        write_giveaway_entrants(giveaway_id, giveaway['entrants'])
+
+    if 'draw_snapshot' in stored:
+        giveaway['draw_snapshot'] = stored['draw_snapshot']
+    elif 'draw_snapshot' in giveaway:
+        write_draw_snapshot(giveaway_id, giveaway['draw_snapshot'])
+
+    if 'entrants' in giveaway and not giveaway.get('ended'):
+        giveaways_needing_resync.add(giveaway_id)
+
+# Giveaway registry - active_giveaways holds every loaded giveaway, indexed here by server and status
+GIVEAWAY_RETENTION = timedelta(days=7)  # ended giveaways stay loaded this long for rerolls, then get archived
+GIVEAWAY_ARCHIVE_INTERVAL = 3600  # seconds between archive sweeps
+GIVEAWAY_ARCHIVE_FILE = f"{DATA_DIR}/giveaway_archive.json"
+GIVEAWAY_LIST_PAGE_SIZE = 10
+giveaway_index = {}  # {guild_id: {'active': set(message_id), 'ended': set(message_id)}}
+giveaway_archiver_task = None
+
+def index_giveaway(giveaway_id):
+    """File a loaded giveaway under its server and current status"""
+    giveaway = active_giveaways[giveaway_id]
+    buckets = giveaway_index.setdefault(giveaway.get('guild_id'), {'active': set(), 'ended': set()})
+    if giveaway.get('ended', False):
+        buckets['active'].discard(giveaway_id)
+        buckets['ended'].add(giveaway_id)
+    else:
+        buckets['ended'].discard(giveaway_id)
+        buckets['active'].add(giveaway_id)
+
+def register_giveaway(giveaway_id, giveaway):
+    """Add a giveaway to the registry"""
+    active_giveaways[giveaway_id] = giveaway
+    index_giveaway(giveaway_id)
+
+def unregister_giveaway(giveaway_id):
+    """Drop a giveaway from memory (its stored copy is left alone)"""
+    giveaway = active_giveaways.pop(giveaway_id, None)
+    if giveaway:
+        buckets = giveaway_index.get(giveaway.get('guild_id'), {})
+        for status_ids in buckets.values():
+            status_ids.discard(giveaway_id)
+
+def mark_giveaway_ended(giveaway_id):
+    """Mark a giveaway as ended, starting its retention window, and save"""
+    giveaway = active_giveaways[giveaway_id]
+    giveaway['ended'] = True
+    giveaway['ended_at'] = datetime.utcnow().isoformat()
+    index_giveaway(giveaway_id)
+    save_data()
+
+def get_guild_giveaways(guild_id, status='active'):
+    """Get a server's loaded giveaways with the given status as (message_id, giveaway) pairs"""
+    giveaway_ids = giveaway_index.get(guild_id, {}).get(status, ())
+    return [(giveaway_id, active_giveaways[giveaway_id]) for giveaway_id in giveaway_ids]
+
+def archive_ended_giveaways():
+    """Move giveaways that ended more than GIVEAWAY_RETENTION ago out of memory and into the archive"""
+    cutoff = datetime.utcnow() - GIVEAWAY_RETENTION
+    expired_ids = []
+    for buckets in giveaway_index.values():
+        for giveaway_id in buckets['ended']:
+            giveaway = active_giveaways[giveaway_id]
+            ended_at = datetime.fromisoformat(giveaway['ended_at']) if giveaway.get('ended_at') else giveaway['end_time']
+            if ended_at < cutoff:
+                expired_ids.append(giveaway_id)
+
+    if not expired_ids:
+        return
+
+    if not mongo_client:
+        # MongoDB keeps ended giveaways in the giveaways collection already; JSON storage gets its own file
+        try:
+            archive = {}
+            if os.path.exists(GIVEAWAY_ARCHIVE_FILE):
+                with open(GIVEAWAY_ARCHIVE_FILE, 'r') as f:
+                    file_content = f.read().strip()
+                    if file_content:
+                        archive = json.loads(file_content)
+
+            for giveaway_id in expired_ids:
+                giveaway = active_giveaways[giveaway_id]
+                archive[str(giveaway_id)] = {**get_giveaway_record(giveaway), 'end_time': giveaway['end_time'].isoformat()}
+
+            with open(GIVEAWAY_ARCHIVE_FILE, 'w') as f:
+                json.dump(archive, f, indent=2)
+        except Exception as e:
+            logging.error(f"Error archiving giveaways: {e}")
+            return
+
+    for giveaway_id in expired_ids:
+        unregister_giveaway(giveaway_id)
+    save_data()
+    logging.info(f"📦 Archived {len(expired_ids)} ended giveaway(s)")
+
+def load_archived_giveaway(giveaway_id):
+    """Load an archived giveaway back into the registry (e.g. to reroll it), returning it or None"""
+    giveaway = None
+    try:
+        if mongo_client:
+            doc = giveaways_collection.find_one({'_id': giveaway_id, 'type_doc': 'giveaways'})
+            if doc:
+                giveaway = {k: v for k, v in doc.items() if k not in ('_id', 'type_doc')}
+                giveaway['message_id'] = doc.get('message_id', giveaway_id)
+        elif os.path.exists(GIVEAWAY_ARCHIVE_FILE):
+            with open(GIVEAWAY_ARCHIVE_FILE, 'r') as f:
+                file_content = f.read().strip()
+                if file_content:
+                    giveaway = json.loads(file_content).get(str(giveaway_id))
+    except Exception as e:
+        logging.error(f"Error loading archived giveaway {giveaway_id}: {e}")
+        return None
+
+    if not giveaway:
+        return None
+
+    if isinstance(giveaway['end_time'], str):
+        giveaway['end_time'] = datetime.fromisoformat(giveaway['end_time'].replace('Z', '+00:00'))
+    load_giveaway_entries(giveaway_id, giveaway)
+    register_giveaway(giveaway_id, giveaway)
+    return giveaway
+
+def start_giveaway_archiver():
+    """Start the periodic giveaway archive sweep if it isn't already running"""
+    global giveaway_archiver_task
+    if giveaway_archiver_task is None or giveaway_archiver_task.done():
+        giveaway_archiver_task = asyncio.create_task(run_giveaway_archiver())
+
+async def run_giveaway_archiver():
+    """Archive expired giveaways every GIVEAWAY_ARCHIVE_INTERVAL seconds"""
+    while True:
+        try:
+            archive_ended_giveaways()
+        except Exception as e:
+            logging.error(f"Error in giveaway archiver: {e}")
+        await asyncio.sleep(GIVEAWAY_ARCHIVE_INTERVAL)
+
+# Outbound DMs - fan-outs run in parallel, but bounded so a 50-winner giveaway doesn't hit the global rate limit
+DM_CONCURRENCY = 5
+DM_MAX_ATTEMPTS = 3
+dm_semaphore = asyncio.Semaphore(DM_CONCURRENCY)
+
+async def send_dm(recipient, **kwargs):
+    """DM a user, retrying transient failures
+
+    Returns 'sent', 'forbidden' (DMs closed or blocked) or 'failed'.
+    """
+    async with dm_semaphore:
+        for attempt in range(1, DM_MAX_ATTEMPTS + 1):
+            try:
+                await recipient.send(**kwargs)
+                return 'sent'
+            except discord.Forbidden:
+                return 'forbidden'
+            except discord.HTTPException as e:
+                # discord.py already waits out 429s it knows about; retry what slips through and server errors
+                if (e.status != 429 and e.status < 500) or attempt == DM_MAX_ATTEMPTS:
+                    logging.error(f"Error sending DM to {recipient}: {e}")
+                    return 'failed'
+                await asyncio.sleep(2 ** attempt)
+            except (OSError, asyncio.TimeoutError) as e:
+                if attempt == DM_MAX_ATTEMPTS:
+                    logging.error(f"Error sending DM to {recipient}: {e}")
+                    return 'failed'
+                await asyncio.sleep(2 ** attempt)
+
+async def send_dms(recipients, **kwargs):
+    """DM the same message to several users in parallel and return {user_id: outcome}"""
+    outcomes = await asyncio.gather(*(send_dm(recipient, **kwargs) for recipient in recipients))
+    return {recipient.id: outcome for recipient, outcome in zip(recipients, outcomes)}
+
+# Outbound role changes - changes waiting for the same member are merged into one member edit, and moderation goes
+# first. One change per member is in flight at a time and each edit starts from the member's current cached roles, so
+# the gateway has delivered any change made by someone else before it's built on
+ROLE_PRIORITY_MODERATION = 0
+ROLE_PRIORITY_COSMETIC = 1
+ROLE_PRIORITY_NAMES = {ROLE_PRIORITY_MODERATION: 'moderation', ROLE_PRIORITY_COSMETIC: 'cosmetic'}
+# Role edits share one rate limit bucket per guild, which discord.py waits out on a 429. These workers take any change,
+# most urgent first; one more worker only takes moderation, so a mute never waits behind perk edits stuck on a 429
+ROLE_ACTION_CONCURRENCY = 2
+pending_role_changes = {}  # {(guild_id, member_id): {'member', 'add', 'remove', 'priority', 'reasons', 'waiters'}}
+role_change_queue = asyncio.PriorityQueue()  # (priority, sequence, key), may hold entries already applied
+moderation_role_change_queue = asyncio.Queue()  # moderation entries again, for the reserved worker
+role_change_sequence = 0
+role_changes_in_flight = {}  # {key: change} being applied right now
+role_changes_deferred = {}  # {key: queue entry} held back until that member's in-flight change finishes
+role_change_workers = []
+role_change_metrics = {'requested': 0, 'edits': 0, 'unchanged': 0, 'failed': 0}
+
+def queue_role_change(member, add=(), remove=(), priority=ROLE_PRIORITY_COSMETIC, reason=None):
+    """Queue roles to add to and remove from a member, merging with any change still waiting for them
+
+    Returns the pending change. Use change_member_roles to wait for the result.
+    """
+    global role_change_sequence
+    key = (member.guild.id, member.id)
+    change = pending_role_changes.get(key)
+    if change is None:
+        change = pending_role_changes[key] = {
+            'member': member,
+            'add': set(),
+            'remove': set(),
+            'priority': priority,
+            'reasons': [],
+            'waiters': []
+        }
+    elif priority >= change['priority']:
+        priority = None  # Already queued at least this urgently
+
+    # The latest request for a role wins
+    for role in add:
+        change['remove'].discard(role.id)
+        change['add'].add(role.id)
+    for role in remove:
+        change['add'].discard(role.id)
+        change['remove'].add(role.id)
+    if reason and reason not in change['reasons']:
+        change['reasons'].append(reason)
+    role_change_metrics['requested'] += 1
+
+    if priority is not None:
+        change['priority'] = priority
+        role_change_sequence += 1
+        start_role_change_workers()
+        enqueue_role_change((priority, role_change_sequence, key))
+    return change
+
+def enqueue_role_change(entry):
+    """Hand a queue entry to the workers - whichever worker reaches a moderation entry first applies it"""
+    role_change_queue.put_nowait(entry)
+    if entry[0] == ROLE_PRIORITY_MODERATION:
+        moderation_role_change_queue.put_nowait(entry)
+
+async def change_member_roles(member, add=(), remove=(), priority=ROLE_PRIORITY_COSMETIC, reason=None):
+    """Queue a role change and wait for it - returns False if the member left, raises on Discord errors"""
+    waiter = asyncio.get_running_loop().create_future()
+    queue_role_change(member, add, remove, priority, reason)['waiters'].append(waiter)
+    return await waiter
+
+def start_role_change_workers():
+    """Start the role change workers, plus the one reserved for moderation, if they aren't already running"""
+    role_change_workers[:] = [worker for worker in role_change_workers if not worker.done()]
+    if not role_change_workers:
+        role_change_workers.append(asyncio.create_task(run_role_change_worker(moderation_role_change_queue)))
+    while len(role_change_workers) < ROLE_ACTION_CONCURRENCY + 1:
+        role_change_workers.append(asyncio.create_task(run_role_change_worker(role_change_queue)))
+
+async def run_role_change_worker(queue):
+    """Apply role changes from a queue, most urgent first"""
+    while True:
+        entry = await queue.get()
+        key = entry[2]
+        if key in role_changes_in_flight:
+            # One change per member at a time, so an add and a later remove of the same role land in order
+            if key not in role_changes_deferred or entry < role_changes_deferred[key]:
+                role_changes_deferred[key] = entry
+            continue
+
+        change = pending_role_changes.pop(key, None)
+        if change is None:
+            continue  # Applied already under a higher priority or by the other queue's worker
+
+        role_changes_in_flight[key] = change
+        try:
+            result = await apply_role_change(change)
+        except Exception as e:
+            role_change_metrics['failed'] += 1
+            logging.error(f"Failed to update roles for {change['member']}: {e}")
+            for waiter in change['waiters']:
+                if not waiter.done():
+                    waiter.set_exception(e)
+        else:
+            for waiter in change['waiters']:
+                if not waiter.done():
+                    waiter.set_result(result)
+        finally:
+            del role_changes_in_flight[key]
+            if key in role_changes_deferred:
+                enqueue_role_change(role_changes_deferred.pop(key))
+
+async def apply_role_change(change):
+    """Apply a merged role change as a single member edit, returning False if the member left"""
+    guild = change['member'].guild
+    member = guild.get_member(change['member'].id)
+    if not member:
+        return False
+
+    # Built from the current cache right before the call - roles[0] is @everyone, which can't be assigned
+    current_roles = member.roles[1:]
+    roles = [role for role in current_roles if role.id not in change['remove']]
+    roles += [role for role in (guild.get_role(role_id) for role_id in change['add']) if role and role not in roles]
+    if set(roles) == set(current_roles):
+        role_change_metrics['unchanged'] += 1
+        return True
+
+    try:
+        await member.edit(roles=roles, reason="; ".join(change['reasons']) or None)
+    except discord.NotFound:
+        return False
+    role_change_metrics['edits'] += 1
+    return True
+
 async def end_giveaway(giveaway_id):
     """End a giveaway and select winners"""
     if giveaway_id not in active_giveaways:
@@ -1232,26 +1930,26 @@ async def end_giveaway(giveaway_id):
         logging.debug(f"Giveaway {giveaway_id} already ended")
         return
 
+    # Ending early (or rerolling) makes any pending timer moot
+    cancel_giveaway_end(giveaway_id)
+
     # Get the message and channel
     channel = bot.get_channel(giveaway['channel_id'])
     if not channel:
         logging.error(f"Could not find channel {giveaway['channel_id']} for giveaway {giveaway_id}")
         # Mark as ended anyway to prevent repeated attempts
-        giveaway['ended'] = True
-        save_data()
+        mark_giveaway_ended(giveaway_id)
         return
 
     try:
         message = await channel.fetch_message(giveaway['message_id'])
     except discord.NotFound:
         logging.warning(f"Giveaway message {giveaway['message_id']} not found")
-        giveaway['ended'] = True
-        save_data()
+        mark_giveaway_ended(giveaway_id)
         return
     except discord.Forbidden:
         logging.error(f"No permission to access message {giveaway['message_id']} in channel {channel.name}")
-        giveaway['ended'] = True
-        save_data()
+        mark_giveaway_ended(giveaway_id)
         return
 
     # Get all users who reacted with 🎉
@@ -1268,64 +1966,35 @@ async def end_giveaway(giveaway_id):
             await message.edit(embed=embed)
         except discord.Forbidden:
             logging.error(f"No permission to edit giveaway message {giveaway['message_id']}")
-        giveaway['ended'] = True
-        save_data()
+        mark_giveaway_ended(giveaway_id)
         return
 
     # Get the guild
     guild = bot.get_guild(giveaway['guild_id'])
     if not guild:
         logging.error(f"Could not find guild {giveaway['guild_id']} for giveaway {giveaway_id}")
-        giveaway['ended'] = True
-        save_data()
+        mark_giveaway_ended(giveaway_id)
         return
 
-    # Get eligible users with improved efficiency
-    eligible_users = []
-    try:
-        # Fetch all users at once to reduce API calls
-        users = [user async for user in reaction.users()]
-
-        # Process users in a single loop for better efficiency
-        for user in users:
-            if user.bot:
-                continue
+    # Resolve the giveaway's rules once for the whole draw
+    get_entry_weight = compile_giveaway_eligibility(giveaway, guild)
 
-            member = guild.get_member(user.id)
-            if not member:
-                continue
-
-            # Check role requirements
-            if giveaway.get('required_role'):
-                required_role_name = giveaway['required_role'].replace('@', '').replace('<', '').replace('>', '')
-                required_role = discord.utils.get(guild.roles, name=required_role_name)
-                if required_role and required_role not in member.roles:
-                    continue
-
-            # Check blacklisted roles
-            if giveaway.get('blacklisted_role'):
-                blacklisted_role_name = giveaway['blacklisted_role'].replace('@', '').replace('<', '').replace('>', '')
-                blacklisted_role = discord.utils.get(guild.roles, name=blacklisted_role_name)
-                if blacklisted_role and blacklisted_role in member.roles:
-                    continue
-
-            # Check if this is the rigged winner - if so, bypass message requirements
-            is_rigged_winner = giveaway.get('rig_winner') and member.id == giveaway['rig_winner']
-
-            # Check message requirements (unless it's a rigged winner)
-            if not is_rigged_winner:
-                # Check if user meets message requirements (default 100 messages)
-                meets_req, user_messages, req_amount = check_message_requirements(member, 100)
-                if not meets_req:
-                    continue  # Skip this user if they don't meet message requirements
-
-            # Apply giveaway entry multiplier
-            entry_multiplier = get_giveaway_entry_multiplier(member)
-
-            # Limit the multiplier to prevent extremely large lists that consume memory
-            # This is especially important for low-RAM environments like 512MB
-            capped_multiplier = min(entry_multiplier, 10)  # Cap at 10 entries per user
-            eligible_users.extend([member] * capped_multiplier)
+    # Build the entry pool from the entrants tracked as they reacted
+    try:
+        entrants = giveaway.get('entrants')
+        # Only a giveaway that was running while the bot was offline can have missed reactions. reaction.count
+        # includes other bots, so a mismatch there means "maybe" and the walk below settles it
+        maybe_stale = (entrants is not None and giveaway_id in giveaways_needing_resync
+                       and len(entrants) != reaction.count - (1 if reaction.me else 0))
+        giveaways_needing_resync.discard(giveaway_id)
+        if entrants is None or maybe_stale:
+            # Giveaway from before entries were tracked, or reactions changed while the bot was offline
+            logging.info(f"Resyncing entrants for giveaway {giveaway_id} from its reactions")
+            entrants = {str(user.id): 0 async for user in reaction.users() if not user.bot}
+            giveaway['entrants'] = entrants
+            write_giveaway_entrants(giveaway_id, entrants)
+
+        eligible_users = build_giveaway_pool(entrants, guild, get_entry_weight)
     except Exception as e:
         logging.error(f"Error processing giveaway entries: {e}")
         embed = discord.Embed(
@@ -1338,8 +2007,7 @@ async def end_giveaway(giveaway_id):
             await message.edit(embed=embed)
         except discord.Forbidden:
             pass
-        giveaway['ended'] = True
-        save_data()
+        mark_giveaway_ended(giveaway_id)
         return
 
     if not eligible_users:
@@ -1353,8 +2021,9 @@ async def end_giveaway(giveaway_id):
             await message.edit(embed=embed)
         except discord.Forbidden:
             pass
-        giveaway['ended'] = True
-        save_data()
+        giveaway['draw_snapshot'] = snapshot_giveaway_draw([], [])
+        write_draw_snapshot(giveaway_id, giveaway['draw_snapshot'])
+        mark_giveaway_ended(giveaway_id)
         return
 
     # Select winners
@@ -1367,28 +2036,11 @@ async def end_giveaway(giveaway_id):
 
         # Check if the rigged winner exists and is in the server
         if rig_member:
-            # Check if rigged winner meets role requirements (but bypass message requirements)
-            should_exclude = False
-
-            # Check role requirements for rigged winner
-            if giveaway.get('required_role'):
-                required_role_name = giveaway['required_role'].replace('@', '').replace('<', '').replace('>', '')
-                required_role = discord.utils.get(guild.roles, name=required_role_name)
-                if required_role and required_role not in rig_member.roles:
-                    should_exclude = True
-
-            # Check blacklisted roles for rigged winner
-            if giveaway.get('blacklisted_role'):
-                blacklisted_role_name = giveaway['blacklisted_role'].replace('@', '').replace('<', '').replace('>', '')
-                blacklisted_role = discord.utils.get(guild.roles, name=blacklisted_role_name)
-                if blacklisted_role and blacklisted_role in rig_member.roles:
-                    should_exclude = True
-
             # Add rigged winner if they meet role requirements (message requirements are bypassed)
-            if not should_exclude:
+            if get_entry_weight(rig_member):
                 winners.append(rig_member)
-                # Remove all instances of the rigged member from eligible_users (for multi-entry)
-                eligible_users = [u for u in eligible_users if u != rig_member]
+                # Remove the rigged member from the pool so they can't be drawn twice
+                eligible_users = [(u, weight) for u, weight in eligible_users if u != rig_member]
             else:
                 # If rigged winner doesn't meet role requirements, they can't win
                 logging.info(f"Rigged winner {rig_member} didn't meet role requirements, skipping...")
@@ -1396,19 +2048,23 @@ async def end_giveaway(giveaway_id):
             # Rigged winner not found in server
             logging.info(f"Rigged winner with ID {rig_id} not found in server")
 
-    # Select remaining winners randomly with improved efficiency
+    # Select remaining winners, weighted by each member's entries
     remaining_winners = min(giveaway['winners'] - len(winners), len(eligible_users))
     if remaining_winners > 0:
-        # Use a more memory-efficient approach for selecting winners
-        # Convert to a set to remove duplicates, then to list for random selection
-        unique_eligible_users = list(set(eligible_users))
-
-        # Randomly shuffle and pick winners to avoid expensive removal operations
-        random.shuffle(unique_eligible_users)
-        selected_winners = unique_eligible_users[:remaining_winners]
+        # Entries were checked when members reacted, so only re-check the members actually drawn
+        selected_winners = draw_weighted_winners(eligible_users, remaining_winners,
+                                                 lambda member: get_entry_weight(member) > 0)
         winners.extend(selected_winners)
 
-    # Create winner announcement
+    # Keep the pool so rerolls can draw from it directly
+    giveaway['draw_snapshot'] = snapshot_giveaway_draw(eligible_users, winners)
+    write_draw_snapshot(giveaway_id, giveaway['draw_snapshot'])
+
+    await announce_giveaway_winners(giveaway_id, giveaway, channel, message, guild, winners)
+    mark_giveaway_ended(giveaway_id)
+
+async def announce_giveaway_winners(giveaway_id, giveaway, channel, message, guild, winners):
+    """Announce a giveaway's winners in its channel, DM them and update the giveaway message"""
     if winners:
         winner_mentions = [winner.mention for winner in winners]
         embed = discord.Embed(
@@ -1429,21 +2085,20 @@ async def end_giveaway(giveaway_id):
         except discord.Forbidden:
             logging.error(f"No permission to send winner announcement in {channel.name}")
 
-        # DM winners with improved efficiency
+        # DM winners in parallel
+        dm_embed = discord.Embed(
+            title="🎉 You Won a Giveaway! 🎉",
+            description=f"**Prize:** {giveaway['prize']}\n"
+                       f"**Server name:** {guild.name}\n\n"
+                       f"Contact {giveaway['host']} to claim your prize!",
+            color=0x00ff00
+        )
+        dm_outcomes = await send_dms(winners, embed=dm_embed)
         for winner in winners:
-            try:
-                dm_embed = discord.Embed(
-                    title="🎉 You Won a Giveaway! 🎉",
-                    description=f"**Prize:** {giveaway['prize']}\n"
-                               f"**Server name:** {guild.name}\n\n"
-                               f"Contact {giveaway['host']} to claim your prize!",
-                    color=0x00ff00
-                )
-                await winner.send(embed=dm_embed)
-            except discord.Forbidden:
+            if dm_outcomes[winner.id] == 'forbidden':
                 logging.info(f"Could not DM winner {winner} - DMs disabled")
-            except Exception as e:
-                logging.error(f"Error sending DM to winner {winner}: {e}")
+        sent_count = sum(1 for outcome in dm_outcomes.values() if outcome == 'sent')
+        logging.info(f"🎉 DM'd {sent_count}/{len(winners)} winner(s) of giveaway {giveaway_id}")
     else:
         embed = discord.Embed(
             title="🎉 GIVEAWAY ENDED 🎉",
@@ -1454,11 +2109,37 @@ async def end_giveaway(giveaway_id):
 
     try:
         await message.edit(embed=embed)
+    except discord.NotFound:
+        logging.warning(f"Giveaway message {giveaway['message_id']} not found")
     except discord.Forbidden:
         logging.error(f"No permission to edit giveaway message {giveaway['message_id']}")
 
-    giveaway['ended'] = True
-    save_data()
+async def reroll_from_snapshot(giveaway_id):
+    """Draw new winners for an ended giveaway from its saved pool, skipping everyone who already won"""
+    giveaway = active_giveaways[giveaway_id]
+    snapshot = giveaway['draw_snapshot']
+
+    channel = bot.get_channel(giveaway['channel_id'])
+    guild = bot.get_guild(giveaway['guild_id'])
+    if not channel or not guild:
+        logging.error(f"Could not find channel or guild for giveaway {giveaway_id}")
+        return None
+
+    # Winners are still checked against the rules, but only from the cache
+    get_entry_weight = compile_giveaway_eligibility(giveaway, guild)
+    already_won = set(snapshot['won'])
+    pool = [(user_id, weight) for user_id, weight in zip(snapshot['ids'], snapshot['weights'])
+            if user_id not in already_won]
+    winner_ids = draw_weighted_winners(pool, giveaway['winners'],
+                                       lambda user_id: get_entry_weight(guild.get_member(user_id)) > 0)
+    winners = [guild.get_member(user_id) for user_id in winner_ids]
+    snapshot['won'].extend(winner_ids)
+    write_draw_snapshot(giveaway_id, snapshot)
+
+    message = channel.get_partial_message(giveaway['message_id'])
+    await announce_giveaway_winners(giveaway_id, giveaway, channel, message, guild, winners)
+    mark_giveaway_ended(giveaway_id)
+    return winners
 
 @bot.tree.command(name="reroll", description="Reroll a giveaway to select new winners")
 @app_commands.describe(message_id="The message ID of the giveaway to reroll")
@@ -1470,7 +2151,7 @@ async def reroll_giveaway(interaction: discord.Interaction, message_id: str):
         await interaction.response.send_message("❌ Invalid message ID format!", ephemeral=True)
         return
 
-    if msg_id not in active_giveaways:
+    if msg_id not in active_giveaways and not load_archived_giveaway(msg_id):
         await interaction.response.send_message("❌ Giveaway not found!", ephemeral=True)
         return
 
@@ -1483,8 +2164,19 @@ async def reroll_giveaway(interaction: discord.Interaction, message_id: str):
     # Defer the interaction since end_giveaway might take some time
     await interaction.response.defer(ephemeral=True)
 
-    # Reset the giveaway state and reroll
+    if giveaway.get('draw_snapshot') is not None:
+        winners = await reroll_from_snapshot(msg_id)
+        if winners is None:
+            await interaction.followup.send("❌ Could not find the giveaway's channel!", ephemeral=True)
+        elif not winners:
+            await interaction.followup.send("❌ No eligible entrants left to reroll!", ephemeral=True)
+        else:
+            await interaction.followup.send("✅ Giveaway rerolled!", ephemeral=True)
+        return
+
+    # Giveaways ended before draw snapshots were kept - reset the giveaway state and reroll
     giveaway['ended'] = False
+    index_giveaway(msg_id)
     await end_giveaway(msg_id)
     await interaction.followup.send("✅ Giveaway rerolled!", ephemeral=True)
 
@@ -1513,42 +2205,55 @@ async def force_end_giveaway(interaction: discord.Interaction, message_id: str):
     await end_giveaway(msg_id)
     await interaction.followup.send("✅ Giveaway ended!", ephemeral=True)
 
-@bot.tree.command(name="list-giveaways", description="List all active giveaways")
+@bot.tree.command(name="list-giveaways", description="List this server's active giveaways")
+@app_commands.describe(page="Page of the list (default: 1)")
 @app_commands.check(lambda interaction: interaction.user.guild_permissions.administrator or any(role.id == 1397370001215983727 for role in interaction.user.roles))
-async def list_giveaways(interaction: discord.Interaction):
-    """List all active giveaways"""
+async def list_giveaways(interaction: discord.Interaction, page: app_commands.Range[int, 1, 100] = 1):
+    """List this server's active giveaways, a page at a time"""
+    giveaways = sorted(get_guild_giveaways(interaction.guild.id), key=lambda item: item[1]['end_time'])
+    page_count = max(1, math.ceil(len(giveaways) / GIVEAWAY_LIST_PAGE_SIZE))
 
-    active_list = []
-    for msg_id, giveaway in active_giveaways.items():
-        if not giveaway.get('ended', False):
-            channel = bot.get_channel(giveaway['channel_id'])
-            channel_name = channel.name if channel else "Unknown Channel"
-            time_left = giveaway['end_time'] - datetime.utcnow()
-            hours, remainder = divmod(int(time_left.total_seconds()), 3600)
-            minutes, _ = divmod(remainder, 60)
-            time_str = f"{hours}h {minutes}m" if hours > 0 else f"{minutes}m"
-
-            active_list.append(
-                f"• **Message ID:** {msg_id}\n"
-                f"  **Prize:** {giveaway['prize']}\n"
-                f"  **Channel:** #{channel_name}\n"
-                f"  **Time Left:** {time_str}\n"
-                f"  **Winners:** {giveaway['winners']}\n"
-            )
-
-    if not active_list:
+    if not giveaways:
         embed = discord.Embed(
             title="📋 Active Giveaways",
             description="No active giveaways found.",
             color=0x00ff00
         )
-    else:
-        embed = discord.Embed(
-            title=f"📋 Active Giveaways ({len(active_list)})",
-            description="\n".join(active_list),
-            color=0x00ff00
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+
+    if page > page_count:
+        await interaction.response.send_message(f"❌ There are only {page_count} page(s) of giveaways!", ephemeral=True)
+        return
+
+    active_list = []
+    offset = (page - 1) * GIVEAWAY_LIST_PAGE_SIZE
+    for msg_id, giveaway in giveaways[offset:offset + GIVEAWAY_LIST_PAGE_SIZE]:
+        channel = bot.get_channel(giveaway['channel_id'])
+        channel_name = channel.name if channel else "Unknown Channel"
+        time_left = giveaway['end_time'] - datetime.utcnow()
+        hours, remainder = divmod(max(0, int(time_left.total_seconds())), 3600)
+        minutes, _ = divmod(remainder, 60)
+        time_str = f"{hours}h {minutes}m" if hours > 0 else f"{minutes}m"
+
+        # Prizes are free text, so cap them to keep a full page under the 4096 character embed limit
+        prize = giveaway['prize'] if len(giveaway['prize']) <= 200 else giveaway['prize'][:197] + "..."
+
+        active_list.append(
+            f"• **Message ID:** {msg_id}\n"
+            f"  **Prize:** {prize}\n"
+            f"  **Channel:** #{channel_name}\n"
+            f"  **Time Left:** {time_str}\n"
+            f"  **Winners:** {giveaway['winners']}\n"
         )
 
+    embed = discord.Embed(
+        title=f"📋 Active Giveaways ({len(giveaways)})",
+        description="\n".join(active_list),
+        color=0x00ff00
+    )
+    embed.set_footer(text=f"Page {page}/{page_count}")
+
     await interaction.response.send_message(embed=embed, ephemeral=True)
 
 @bot.tree.command(name="invites", description="Check how many invites a user has")
@@ -1587,16 +2292,77 @@ async def check_invites(interaction: discord.Interaction, user: discord.Member =
     await interaction.response.send_message(embed=embed)
 
 
+# Leaderboard response cache
+LEADERBOARD_CACHE_TTL = 60  # seconds
+LEADERBOARD_PAGE_SIZE = 10
+leaderboard_cache = {}  # {(guild_id, board, period, page): {'embed': dict, 'expires': float, 'user_ids': set, 'threshold': value}}
+
+def get_leaderboard_page(sorted_users, page):
+    """Slice one page out of a sorted leaderboard, returning (offset, rows)"""
+    offset = (page - 1) * LEADERBOARD_PAGE_SIZE
+    return offset, sorted_users[offset:offset + LEADERBOARD_PAGE_SIZE]
+
+def get_cached_leaderboard(guild_id, board, period, page):
+    """Return a cached leaderboard embed if it is still fresh"""
+    key = (guild_id, board, period, page)
+    entry = leaderboard_cache.get(key)
+    if not entry:
+        return None
+
+    if entry['expires'] < time.monotonic():
+        leaderboard_cache.pop(key, None)
+        return None
+
+    return discord.Embed.from_dict(entry['embed'])
+
+def cache_leaderboard(guild_id, board, period, page, embed, rows, value_of):
+    """Store a rendered leaderboard page along with what it takes to invalidate it"""
+    # A page only changes if one of its rows moves or someone climbs past its lowest row.
+    # A page that isn't full also changes whenever anyone new appears below it.
+    if len(rows) < LEADERBOARD_PAGE_SIZE:
+        threshold = float('-inf')
+    else:
+        threshold = value_of(rows[-1])
+
+    leaderboard_cache[(guild_id, board, period, page)] = {
+        'embed': embed.to_dict(),
+        'expires': time.monotonic() + LEADERBOARD_CACHE_TTL,
+        'user_ids': {user_id for user_id, _ in rows},
+        'threshold': threshold
+    }
+
+def invalidate_leaderboard(board, user_id=None, values=None):
+    """Drop cached leaderboard pages whose ranking is affected by a change
+
+    Without a user_id/values every cached page of the board is dropped. Otherwise
+    values maps each period to the user's new score on that board.
+    """
+    for key, entry in list(leaderboard_cache.items()):
+        if key[1] != board:
+            continue
+
+        if user_id is not None and values is not None:
+            new_value = values.get(key[2])
+            if new_value is not None and user_id not in entry['user_ids'] and new_value < entry['threshold']:
+                continue  # Ranking on this page is unchanged
+
+        leaderboard_cache.pop(key, None)
+
 @bot.tree.command(name="invite-leaderboard", description="Show invite leaderboards")
-@app_commands.describe(type="Type of invites to show")
+@app_commands.describe(type="Type of invites to show", page="Leaderboard page (default: 1)")
 @app_commands.choices(type=[
     app_commands.Choice(name="Total Invites", value="total"),
     app_commands.Choice(name="Real Invites", value="real")
 ])
-async def invite_leaderboard(interaction: discord.Interaction, type: app_commands.Choice[str]):
+async def invite_leaderboard(interaction: discord.Interaction, type: app_commands.Choice[str], page: app_commands.Range[int, 1, 100] = 1):
     """Show invite leaderboards for total and real invites"""
     invite_type = type.value
 
+    cached_embed = get_cached_leaderboard(interaction.guild.id, 'invites', invite_type, page)
+    if cached_embed:
+        await interaction.response.send_message(embed=cached_embed)
+        return
+
     if invite_type == "total":
         # Sort users by total invites
         sorted_users = sorted(
@@ -1605,30 +2371,32 @@ async def invite_leaderboard(interaction: discord.Interaction, type: app_command
             reverse=True
         )
 
-        # Get top 10 users
-        top_users = sorted_users[:10]
+        # Get the requested page of users
+        offset, top_users = get_leaderboard_page(sorted_users, page)
 
         if not top_users:
-            await interaction.response.send_message("❌ No invites recorded yet!", ephemeral=True)
+            await interaction.response.send_message("❌ No invites recorded yet!" if page == 1 else "❌ That page is empty!", ephemeral=True)
             return
 
         # Create leaderboard text
-        leaderboard_text = ""
+        leaderboard_lines = []
         medals = ["🥇", "🥈", "🥉"]
 
-        for i, (user_id, data) in enumerate(top_users):
+        for i, (user_id, data) in enumerate(top_users, start=offset):
             user = interaction.guild.get_member(user_id)
             if user:
                 count = data['invites'] if 'invites' in data else 0
                 medal = medals[i] if i < 3 else f"#{i+1}"
-                leaderboard_text += f"{medal} **{user.display_name}** - {count} invites\n"
+                leaderboard_lines.append(f"{medal} **{user.display_name}** - {count} invites")
 
         embed = discord.Embed(
             title="📊 Total Invite Leaderboard",
-            description=leaderboard_text or "No users found!",
+            description="\n".join(leaderboard_lines) or "No users found!",
             color=0x00ff00
         )
         embed.set_footer(text="Total invites include all invites (regular, left, fake)")
+        cache_leaderboard(interaction.guild.id, 'invites', invite_type, page, embed, top_users,
+                          lambda row: row[1]['invites'] if 'invites' in row[1] else 0)
 
     elif invite_type == "real":
         # For real invites, we need to calculate based on members still in the server
@@ -1657,45 +2425,52 @@ async def invite_leaderboard(interaction: discord.Interaction, type: app_command
             reverse=True
         )
 
-        # Get top 10 users
-        top_users = sorted_users[:10]
+        # Get the requested page of users
+        offset, top_users = get_leaderboard_page(sorted_users, page)
 
         if not top_users:
-            await interaction.response.send_message("❌ No real invites recorded yet!", ephemeral=True)
+            await interaction.response.send_message("❌ No real invites recorded yet!" if page == 1 else "❌ That page is empty!", ephemeral=True)
             return
 
         # Create leaderboard text
-        leaderboard_text = ""
+        leaderboard_lines = []
         medals = ["🥇", "🥈", "🥉"]
 
-        for i, (user_id, count) in enumerate(top_users):
+        for i, (user_id, count) in enumerate(top_users, start=offset):
             user = interaction.guild.get_member(user_id)
             if user:
                 medal = medals[i] if i < 3 else f"#{i+1}"
-                leaderboard_text += f"{medal} **{user.display_name}** - {count} real invites\n"
+                leaderboard_lines.append(f"{medal} **{user.display_name}** - {count} real invites")
 
         embed = discord.Embed(
             title="📊 Real Invite Leaderboard",
-            description=leaderboard_text or "No users found!",
+            description="\n".join(leaderboard_lines) or "No users found!",
             color=0x00ff00
         )
         embed.set_footer(text="Real invites: People who joined and stayed in the server")
+        # Real invites depend on who is still in the server, so rely on the TTL and join invalidation
+        cache_leaderboard(interaction.guild.id, 'invites', invite_type, page, embed, top_users, lambda row: row[1])
 
     await interaction.response.send_message(embed=embed)
 
 
 @bot.tree.command(name="message-leaderboard", description="Show message leaderboards")
-@app_commands.describe(period="Time period for the leaderboard")
+@app_commands.describe(period="Time period for the leaderboard", page="Leaderboard page (default: 1)")
 @app_commands.choices(period=[
     app_commands.Choice(name="Daily", value="daily"),
     app_commands.Choice(name="Weekly", value="weekly"),
     app_commands.Choice(name="Monthly", value="monthly"),
     app_commands.Choice(name="Total", value="total")
 ])
-async def message_leaderboard(interaction: discord.Interaction, period: app_commands.Choice[str]):
+async def message_leaderboard(interaction: discord.Interaction, period: app_commands.Choice[str], page: app_commands.Range[int, 1, 100] = 1):
     """Show message leaderboards for different time periods"""
     period_key = period.value
 
+    cached_embed = get_cached_leaderboard(interaction.guild.id, 'messages', period_key, page)
+    if cached_embed:
+        await interaction.response.send_message(embed=cached_embed)
+        return
+
     # Sort users by message count for the specified period
     sorted_users = sorted(
         message_counts.items(),
@@ -1703,29 +2478,34 @@ async def message_leaderboard(interaction: discord.Interaction, period: app_comm
         reverse=True
     )
 
-    # Get top 10 users
-    top_users = sorted_users[:10]
+    # Get the requested page of users
+    offset, top_users = get_leaderboard_page(sorted_users, page)
 
     if not top_users:
-        await interaction.response.send_message(f"❌ No messages recorded for {period_key} period yet!", ephemeral=True)
+        if page == 1:
+            await interaction.response.send_message(f"❌ No messages recorded for {period_key} period yet!", ephemeral=True)
+        else:
+            await interaction.response.send_message("❌ That page is empty!", ephemeral=True)
         return
 
     # Create leaderboard text
-    leaderboard_text = ""
+    leaderboard_lines = []
     medals = ["🥇", "🥈", "🥉"]
 
-    for i, (user_id, data) in enumerate(top_users):
+    for i, (user_id, data) in enumerate(top_users, start=offset):
         user = interaction.guild.get_member(user_id)
         if user:
             count = data.get(period_key, 0)
             medal = medals[i] if i < 3 else f"#{i+1}"
-            leaderboard_text += f"{medal} **{user.display_name}** - {count} messages\n"
+            leaderboard_lines.append(f"{medal} **{user.display_name}** - {count} messages")
 
     embed = discord.Embed(
         title=f"📊 {period_key.capitalize()} Message Leaderboard",
-        description=leaderboard_text or "No users found!",
+        description="\n".join(leaderboard_lines) or "No users found!",
         color=0x00ff00
     )
+    cache_leaderboard(interaction.guild.id, 'messages', period_key, page, embed, top_users,
+                      lambda row: row[1].get(period_key, 0))
 
     await interaction.response.send_message(embed=embed)
 
@@ -1785,6 +2565,7 @@ async def warn_user(interaction: discord.Interaction, user: discord.Member, reas
         # Permanent ban
         try:
             await user.ban(reason=f"Automatic ban - {warning_count} warnings")
+            clear_punishment(user.id)  # a pending temp ban expiry must not lift the permanent ban
             punishment_message = "\n🔨 **PERMANENT BAN** applied automatically!"
         except discord.Forbidden:
             punishment_message = "\n❌ Failed to ban user (insufficient permissions)"
@@ -1792,14 +2573,16 @@ async def warn_user(interaction: discord.Interaction, user: discord.Member, reas
         # 30 day temp ban
         try:
             await user.ban(reason=f"Automatic 30-day ban - {warning_count} warnings")
+            until_date = datetime.utcnow() + timedelta(days=30)
             active_punishments[user.id] = {
                 'type': 'tempban',
-                'until': datetime.utcnow() + timedelta(days=30),
-                'reason': f'30-day ban for {warning_count} warnings'
+                'until': until_date,
+                'reason': f'30-day ban for {warning_count} warnings',
+                'guild_id': interaction.guild.id
             }
             punishment_message = "\n🔨 **30-DAY BAN** applied automatically!"
             # Schedule unban
-            asyncio.create_task(schedule_unban(user.id, interaction.guild.id, 30 * 24 * 3600))
+            schedule_punishment_expiry(user.id, until_date)
         except discord.Forbidden:
             punishment_message = "\n❌ Failed to ban user (insufficient permissions)"
     elif warning_count >= 25:
@@ -1840,21 +2623,18 @@ async def warn_user(interaction: discord.Interaction, user: discord.Member, reas
 
     embed.description += punishment_message
 
-    # Send warning DM to user
-    try:
-        dm_embed = discord.Embed(
-            title="⚠️ You Received a Warning",
-            description=f"**Server:** {interaction.guild.name}\n"
-                       f"**Reason:** {reason}\n"
-                       f"**Total Warnings:** {warning_count}\n"
-                       f"**Moderator:** {moderator.name}",
-            color=0xffaa00
-        )
-        if punishment_message:
-            dm_embed.description += punishment_message
-        await user.send(embed=dm_embed)
-    except discord.Forbidden:
-        pass  # User has DMs disabled
+    # Send warning DM to user (DMs disabled is fine)
+    dm_embed = discord.Embed(
+        title="⚠️ You Received a Warning",
+        description=f"**Server:** {interaction.guild.name}\n"
+                   f"**Reason:** {reason}\n"
+                   f"**Total Warnings:** {warning_count}\n"
+                   f"**Moderator:** {moderator.name}",
+        color=0xffaa00
+    )
+    if punishment_message:
+        dm_embed.description += punishment_message
+    start_background_task(send_dm(user, embed=dm_embed))  # retries mustn't hold up the interaction response
 
     # Save data
     save_data()
@@ -2016,11 +2796,12 @@ async def unmute_user(interaction: discord.Interaction, user: discord.Member):
         return
 
     try:
-        await user.remove_roles(muted_role, reason=f"Manual unmute by {interaction.user.name}")
+        await change_member_roles(user, remove=[muted_role], priority=ROLE_PRIORITY_MODERATION,
+                                  reason=f"Manual unmute by {interaction.user.name}")
 
         # Remove from active punishments
         if user.id in active_punishments and active_punishments[user.id]['type'] == 'mute':
-            del active_punishments[user.id]
+            clear_punishment(user.id)
 
         embed = discord.Embed(
             title="🔊 User Unmuted",
@@ -2071,7 +2852,7 @@ async def unban_user(interaction: discord.Interaction, user_id: str):
 
         # Remove from active punishments
         if user_id_int in active_punishments:
-            del active_punishments[user_id_int]
+            clear_punishment(user_id_int)
 
         embed = discord.Embed(
             title="🔓 User Unbanned",
@@ -2103,8 +2884,8 @@ async def unban_user(interaction: discord.Interaction, user_id: str):
     except discord.Forbidden:
         await interaction.response.send_message("❌ I don't have permission to unban users!", ephemeral=True)
 
-async def apply_mute(user: discord.Member, guild: discord.Guild, days: int, reason: str):
-    """Apply mute to a user for specified days"""
+async def apply_mute(user: discord.Member, guild: discord.Guild, days: int, reason: str, save=True):
+    """Apply mute to a user for specified days - save=False leaves saving to a debounced save"""
     # Get existing muted role by ID
     muted_role = guild.get_role(1396988857224003595)
 
@@ -2112,33 +2893,138 @@ async def apply_mute(user: discord.Member, guild: discord.Guild, days: int, reas
         return False  # Muted role doesn't exist
 
     try:
-        await user.add_roles(muted_role, reason=reason)
+        if not await change_member_roles(user, add=[muted_role], priority=ROLE_PRIORITY_MODERATION, reason=reason):
+            return False  # Left the server
 
         # Store mute data
         until_date = datetime.utcnow() + timedelta(days=days)
         active_punishments[user.id] = {
             'type': 'mute',
             'until': until_date,
-            'reason': reason
+            'reason': reason,
+            'guild_id': guild.id
         }
 
         # Schedule unmute
-        asyncio.create_task(schedule_unmute(user.id, guild.id, days * 24 * 3600))
+        schedule_punishment_expiry(user.id, until_date)
 
         # Save data
-        save_data()
+        if save:
+            save_data()
+        else:
+            schedule_save_data()
 
         return True
     except discord.Forbidden:
         return False
 
-async def schedule_unmute(user_id: int, guild_id, delay_seconds: float):
-    """Schedule automatic unmute"""
-    await asyncio.sleep(delay_seconds)
+# Punishment expiry - active_punishments is the persisted queue, a heap indexes it by due time for one sweeper task
+PUNISHMENT_SWEEP_BATCH = 25  # expiries processed concurrently per sweep
+PUNISHMENT_RETRY_DELAY = 300  # seconds before retrying an expiry that failed on a Discord error or an unavailable server
+punishment_schedule = []  # min-heap of (until, user_id), may hold stale entries
+punishment_expiry_times = {}  # {user_id: until} - the live schedule; heap entries that don't match it are skipped
+punishment_sweeper_wakeup = asyncio.Event()
+punishment_sweeper_task = None
+
+def start_punishment_sweeper():
+    """Start the punishment sweeper task if it isn't already running"""
+    global punishment_sweeper_task
+    if punishment_sweeper_task is None or punishment_sweeper_task.done():
+        punishment_sweeper_task = asyncio.create_task(run_punishment_sweeper())
+
+def schedule_punishment_expiry(user_id, until):
+    """Schedule a user's punishment to be lifted at until, replacing any earlier schedule for them"""
+    if punishment_expiry_times.get(user_id) == until:
+        return  # already scheduled, e.g. load_data running again on reconnect
+
+    punishment_expiry_times[user_id] = until
+    heapq.heappush(punishment_schedule, (until, user_id))
+
+    start_punishment_sweeper()
+    punishment_sweeper_wakeup.set()  # the new expiry may be sooner than what the sweeper sleeps on
+
+def clear_punishment(user_id):
+    """Forget a user's punishment and its pending expiry"""
+    active_punishments.pop(user_id, None)
+    punishment_expiry_times.pop(user_id, None)
+
+    # save_data only upserts, so lifted punishments have to be removed from MongoDB explicitly
+    if mongo_client:
+        try:
+            punishments_collection.delete_one({'_id': user_id})
+        except Exception as e:
+            logging.error(f"Error removing punishment for {user_id} from MongoDB: {e}")
+
+async def run_punishment_sweeper():
+    """Lift punishments as they come due, in batches"""
+    while True:
+        # Drop lifted and rescheduled entries
+        while punishment_schedule and punishment_expiry_times.get(punishment_schedule[0][1]) != punishment_schedule[0][0]:
+            heapq.heappop(punishment_schedule)
 
+        punishment_sweeper_wakeup.clear()
+
+        if not punishment_schedule:
+            await punishment_sweeper_wakeup.wait()
+            continue
+
+        delay_seconds = (punishment_schedule[0][0] - datetime.utcnow()).total_seconds()
+        if delay_seconds > 0:
+            # Sleep until the next one is due, or until a sooner one is scheduled
+            try:
+                await asyncio.wait_for(punishment_sweeper_wakeup.wait(), timeout=delay_seconds)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        # Everything overdue (e.g. after downtime) is taken in batches rather than one by one
+        now = datetime.utcnow()
+        batch = []
+        while punishment_schedule and punishment_schedule[0][0] <= now and len(batch) < PUNISHMENT_SWEEP_BATCH:
+            until, user_id = heapq.heappop(punishment_schedule)
+            if punishment_expiry_times.get(user_id) == until:
+                del punishment_expiry_times[user_id]
+                batch.append(user_id)
+
+        results = await asyncio.gather(*(expire_punishment(user_id) for user_id in batch), return_exceptions=True)
+        for user_id, result in zip(batch, results):
+            if isinstance(result, Exception):
+                # The entry was already taken off the schedule, so retry it rather than leave it stuck
+                logging.error(f"Error lifting punishment for {user_id}, retrying in {PUNISHMENT_RETRY_DELAY}s: {result}")
+                if user_id in active_punishments:
+                    schedule_punishment_expiry(user_id, now + timedelta(seconds=PUNISHMENT_RETRY_DELAY))
+
+        save_data()
+        logging.info(f"⏰ Swept {len(batch)} expired punishment(s)")
+
+async def expire_punishment(user_id):
+    """Lift a due punishment, retrying later if Discord had a hiccup"""
+    punishment = active_punishments.get(user_id)
+    if not punishment:
+        return
+
+    try:
+        if punishment['type'] == 'mute':
+            await expire_mute(user_id, punishment.get('guild_id'))
+        elif punishment['type'] == 'tempban':
+            if not await expire_tempban(user_id, punishment.get('guild_id')):
+                logging.warning(f"Server for {user_id}'s temp ban is unavailable, retrying in {PUNISHMENT_RETRY_DELAY}s")
+                schedule_punishment_expiry(user_id, datetime.utcnow() + timedelta(seconds=PUNISHMENT_RETRY_DELAY))
+                return
+    except discord.HTTPException as e:
+        if not isinstance(e, (discord.Forbidden, discord.NotFound)):
+            logging.warning(f"Could not lift {punishment['type']} for {user_id}, retrying in {PUNISHMENT_RETRY_DELAY}s: {e}")
+            schedule_punishment_expiry(user_id, datetime.utcnow() + timedelta(seconds=PUNISHMENT_RETRY_DELAY))
+            return
+        logging.error(f"Missing permissions to lift {punishment['type']} for {user_id}: {e}")
+
+    clear_punishment(user_id)
+
+async def expire_mute(user_id: int, guild_id):
+    """Remove an expired mute"""
     guild = bot.get_guild(guild_id) if guild_id else None
     if not guild:
-        # Try to find guild from active punishments
+        # Records from before guild_id was stored - find the server they're in
         for g in bot.guilds:
             if g.get_member(user_id):
                 guild = g
@@ -2153,56 +3039,33 @@ async def schedule_unmute(user_id: int, guild_id, delay_seconds: float):
 
     muted_role = guild.get_role(1396988857224003595)
     if muted_role and muted_role in user.roles:
-        try:
-            await user.remove_roles(muted_role, reason="Automatic unmute - punishment expired")
-
-            # Remove from active punishments
-            if user_id in active_punishments:
-                del active_punishments[user_id]
-
-            # Save data
-            save_data()
+        await change_member_roles(user, remove=[muted_role], priority=ROLE_PRIORITY_MODERATION,
+                                  reason="Automatic unmute - punishment expired")
 
-            # Send DM notification
-            try:
-                embed = discord.Embed(
-                    title="🔊 Mute Expired",
-                    description=f"Your mute in **{guild.name}** has expired. You can now speak again!",
-                    color=0x00ff00
-                )
-                await user.send(embed=embed)
-            except discord.Forbidden:
-                pass
-        except discord.Forbidden:
-            pass
-
-async def schedule_unban(user_id: int, guild_id, delay_seconds: float):
-    """Schedule automatic unban"""
-    await asyncio.sleep(delay_seconds)
+        # Send DM notification
+        embed = discord.Embed(
+            title="🔊 Mute Expired",
+            description=f"Your mute in **{guild.name}** has expired. You can now speak again!",
+            color=0x00ff00
+        )
+        await send_dm(user, embed=embed)
 
-    guild = bot.get_guild(guild_id) if guild_id else None
-    if not guild:
-        # Try to find guild from bot's guilds
-        if bot.guilds:
-            guild = bot.guilds[0]  # Use first available guild
+async def expire_tempban(user_id: int, guild_id):
+    """Lift an expired temp ban in the server that issued it, returning False if that server isn't available yet"""
+    if not guild_id:
+        # Records from before guild_id was stored - the ban could be in any server, so leave it to a moderator
+        logging.warning(f"Temp ban for {user_id} has no server recorded, it must be lifted manually")
+        return True
 
+    guild = bot.get_guild(guild_id)
     if not guild:
-        return
+        return False  # Guild unavailable or the bot was removed - try again later
 
     try:
         await guild.unban(discord.Object(id=user_id), reason="Automatic unban - temp ban expired")
-
-        # Remove from active punishments
-        if user_id in active_punishments:
-            del active_punishments[user_id]
-
-        # Save data
-        save_data()
-
-    except discord.Forbidden:
-        pass
     except discord.NotFound:
-        pass  # User wasn't banned
+        pass  # Already unbanned
+    return True
 
 @bot.event
 async def on_message(message):
@@ -2219,8 +3082,11 @@ async def on_message(message):
     
     # Add current message timestamp
     spam_cache[user_id]['messages'].append({
+        'id': message.id,
+        'channel': message.channel,
         'content': message.content,
-        'time': current_time
+        'time': current_time,
+        'flagged': False
     })
     
     # Remove old messages outside time window
@@ -2231,8 +3097,16 @@ async def on_message(message):
     
     # Check for rapid message spam
     if len(spam_cache[user_id]['messages']) > SPAM_THRESHOLD:
+        # Delete the whole burst, not just the message that tipped it over
+        burst_by_channel = {}
+        for m in spam_cache[user_id]['messages']:
+            if not m['flagged']:
+                m['flagged'] = True
+                burst_by_channel.setdefault(m['channel'], []).append(m['id'])
+        for channel, message_ids in burst_by_channel.items():
+            queue_spam_deletion(channel, message_ids)
+
         try:
-            await message.delete()
             spam_cache[user_id]['warnings'] += 1
             
             if spam_cache[user_id]['warnings'] == 1:
@@ -2241,7 +3115,8 @@ async def on_message(message):
                 # Mute after 3 spam warnings
                 muted_role = message.guild.get_role(1396988857224003595)
                 if muted_role:
-                    await message.author.add_roles(muted_role)
+                    await change_member_roles(message.author, add=[muted_role], priority=ROLE_PRIORITY_MODERATION,
+                                              reason="Spam")
                     await message.author.send("🔇 You've been muted for spam. Contact a moderator to appeal.")
                 spam_cache[user_id]['warnings'] = 0
         except discord.Forbidden:
@@ -2310,6 +3185,10 @@ async def on_message(message):
     message_counts[user_id]['weekly'] += 1
     message_counts[user_id]['monthly'] += 1
     message_counts[user_id]['last_message_date'] = str(current_date)
+    invalidate_leaderboard('messages', user_id, {
+        period_key: message_counts[user_id][period_key]
+        for period_key in ('daily', 'weekly', 'monthly', 'total')
+    })
 
     # Add XP and check for level up
     level_up, xp_gained = await add_xp(user_id, base_xp, message.author)
@@ -2371,7 +3250,7 @@ async def on_member_update(before, after):
         # Give Server Booster role if they don't have it
         if server_booster_role and server_booster_role not in after.roles:
             try:
-                await after.add_roles(server_booster_role)
+                await change_member_roles(after, add=[server_booster_role])
                 print(f"Added Server Booster role to {after.name}")
             except discord.Forbidden:
                 print(f"Failed to add Server Booster role to {after.name} - missing permissions")
@@ -2390,7 +3269,7 @@ async def on_member_update(before, after):
         roles_to_remove = [role for role in booster_roles if role and role in after.roles]
         if roles_to_remove:
             try:
-                await after.remove_roles(*roles_to_remove)
+                await change_member_roles(after, remove=roles_to_remove)
                 print(f"Removed booster roles from {after.name}: {[role.name for role in roles_to_remove]}")
             except discord.Forbidden:
                 print(f"Failed to remove booster roles from {after.name} - missing permissions")
@@ -2412,43 +3291,169 @@ async def on_invite_delete(invite):
     if guild_id in cached_invites and invite.code in cached_invites[guild_id]:
         del cached_invites[guild_id][invite.code]
 
+# Join attribution - joins arriving together share one invite fetch, and each guild's diffs run one at a time
+INVITE_BATCH_WINDOW = 1.5  # seconds to collect joins before fetching invites
+INVITE_UNCLAIMED_TTL = 30  # seconds an invite use can wait for its join event
+invite_join_batches = {}  # {guild_id: [(member, future), ...]} waiting for the next fetch
+invite_locks = {}  # {guild_id: asyncio.Lock} guarding that guild's cached_invites
+unclaimed_invite_uses = {}  # {guild_id: [(invite, seen_at), ...]} uses fetched before their join event arrived
+
+def get_invite_lock(guild_id):
+    """Get the lock that serializes invite fetches and cache updates for a guild"""
+    if guild_id not in invite_locks:
+        invite_locks[guild_id] = asyncio.Lock()
+    return invite_locks[guild_id]
+
+async def fetch_guild_invites(guild):
+    """Fetch a guild's invites, plus its vanity invite when it has one"""
+    current_invites = await guild.invites()
+    if 'VANITY_URL' in guild.features:
+        try:
+            vanity_invite = await guild.vanity_invite()
+            if vanity_invite:
+                current_invites.append(vanity_invite)
+        except discord.HTTPException:
+            pass
+    return current_invites
+
+# Invite cache warm-up - every guild is read on startup, reconnect and every INVITE_REFRESH_INTERVAL
+INVITE_WARM_UP_CONCURRENCY = 3
+INVITE_FETCH_SPACING = 1.0  # seconds each warm-up slot waits between guilds
+INVITE_REFRESH_INTERVAL = 1800
+invite_refresher_task = None
+
+async def refresh_guild_invites(guild):
+    """Replace a guild's cached invite uses with fresh counts, returning whether it could read them"""
+    async with get_invite_lock(guild.id):
+        try:
+            current_invites = await fetch_guild_invites(guild)
+        except discord.Forbidden:
+            return False
+
+        # Joins waiting on a batch still need the old counts to be diffed - that batch updates the cache itself
+        if guild.id not in invite_join_batches:
+            cached_invites[guild.id] = {invite.code: invite.uses or 0 for invite in current_invites}
+    return True
+
+async def warm_invite_cache(guilds):
+    """Refresh the invite cache for many guilds concurrently, pacing the fetches"""
+    semaphore = asyncio.Semaphore(INVITE_WARM_UP_CONCURRENCY)
+
+    async def warm(guild):
+        async with semaphore:
+            try:
+                return await refresh_guild_invites(guild)
+            except Exception as e:
+                logging.error(f"Error caching invites for {guild.name}: {e}")
+                return False
+            finally:
+                await asyncio.sleep(INVITE_FETCH_SPACING)
+
+    guilds = list(guilds)
+    results = await asyncio.gather(*(warm(guild) for guild in guilds))
+    logging.info(f"📨 Cached invites for {sum(results)}/{len(guilds)} server(s)")
+
+def start_invite_refresher():
+    """Start the periodic invite cache refresh if it isn't already running"""
+    global invite_refresher_task
+    if invite_refresher_task is None or invite_refresher_task.done():
+        invite_refresher_task = asyncio.create_task(run_invite_refresher())
+
+async def run_invite_refresher():
+    """Correct drifted invite counts every INVITE_REFRESH_INTERVAL seconds"""
+    while True:
+        await asyncio.sleep(INVITE_REFRESH_INTERVAL)
+        try:
+            await warm_invite_cache(bot.guilds)
+        except Exception as e:
+            logging.error(f"Error in invite refresher: {e}")
+
+@bot.event
+async def on_guild_join(guild):
+    """Start tracking invites in a server the bot was just added to"""
+    await refresh_guild_invites(guild)
+
 async def get_invite_used(member):
     """Determine which invite was used by a member joining the server"""
-    guild = member.guild
+    guild_id = member.guild.id
+    future = asyncio.get_running_loop().create_future()
+
+    batch = invite_join_batches.get(guild_id)
+    if batch is None:
+        # First join of a new window - it resolves every join that arrives before the fetch
+        batch = invite_join_batches[guild_id] = []
+        start_background_task(resolve_invite_batch(member.guild))
+    batch.append((member, future))
+
+    return await future
+
+async def resolve_invite_batch(guild):
+    """Wait out the batch window, then attribute every join collected in it from one invite fetch"""
+    await asyncio.sleep(INVITE_BATCH_WINDOW)
+
+    async with get_invite_lock(guild.id):
+        # Joins that arrived while waiting for the lock are still covered by the fetch below
+        batch = invite_join_batches.pop(guild.id, [])
+        try:
+            invites_used = await attribute_invite_batch(guild, [member for member, _ in batch])
+        except Exception as e:
+            logging.error(f"Error resolving invites for {len(batch)} join(s) in {guild.name}: {e}")
+            invites_used = [None] * len(batch)
+
+    for (member, future), invite in zip(batch, invites_used):
+        if not future.done():
+            future.set_result(invite)
+
+async def attribute_invite_batch(guild, members):
+    """Diff invite uses against the cache and match the invites used to members in join order
+
+    Returns one invite (or None) per member. Must be called holding the guild's invite lock.
+    """
     guild_id = guild.id
 
     # Get current invites
     try:
-        current_invites = await guild.invites()
+        current_invites = await fetch_guild_invites(guild)
     except discord.Forbidden:
         # If bot doesn't have permission to view invites, return None
-        return None
+        return [None] * len(members)
 
     # Initialize cached invites for this guild if needed
     if guild_id not in cached_invites:
-        cached_invites[guild_id] = {}
-        # Cache current invites
-        for invite in current_invites:
-            cached_invites[guild_id][invite.code] = invite.uses or 0
-        return None  # Can't determine for first tracking
-
-    # Find the invite that was used
+        cached_invites[guild_id] = {invite.code: invite.uses or 0 for invite in current_invites}
+        return [None] * len(members)  # Can't determine for first tracking
+
+    # One slot per use since the last fetch, so three joins through one invite get it three times.
+    # Uses left over from the last batch go first - their joins were still on the way then
+    now = datetime.utcnow()
+    cutoff = now - timedelta(seconds=INVITE_UNCLAIMED_TTL)
+    used_slots = [(invite, seen_at) for invite, seen_at in unclaimed_invite_uses.pop(guild_id, []) if seen_at > cutoff]
+    guild_cache = cached_invites[guild_id]
     for invite in current_invites:
-        cached_uses = cached_invites[guild_id].get(invite.code, 0)
+        cached_uses = guild_cache.get(invite.code, 0)
         if invite.uses and invite.uses > cached_uses:
-            # This is the invite that was used
-            cached_invites[guild_id][invite.code] = invite.uses
-            return invite
+            used_slots.extend([(invite, now)] * (invite.uses - cached_uses))
+        guild_cache[invite.code] = invite.uses or 0
+
+    invites_used = {}
+    join_order = sorted(members, key=lambda member: member.joined_at or discord.utils.snowflake_time(member.id))
+    for member in join_order:
+        if used_slots:
+            invites_used[member.id] = used_slots.pop(0)[0]
+            continue
+
+        # If no invite was incremented, try to find one that matches the approximate creation time
+        join_time = member.joined_at or discord.utils.snowflake_time(member.id)
+        for invite in current_invites:
+            # If invite was created close to the member's join time, it might be the vanity or temporary one
+            if invite.created_at and abs((invite.created_at - join_time).total_seconds()) < 30:  # Within 30 seconds
+                invites_used[member.id] = invite
+                break
 
-    # If no invite was incremented, try to find one that matches the approximate creation time
-    join_time = member.joined_at or discord.utils.snowflake_time(member.id)
-    for invite in current_invites:
-        # If invite was created close to the member's join time, it might be the vanity or temporary one
-        if abs((invite.created_at - join_time).total_seconds()) < 30:  # Within 30 seconds
-            cached_invites[guild_id][invite.code] = invite.uses or 0
-            return invite
+    if used_slots:
+        unclaimed_invite_uses[guild_id] = used_slots
 
-    return None
+    return [invites_used.get(member.id) for member in members]
 
 @bot.event
 async def on_message_delete(message):
@@ -2465,15 +3470,191 @@ async def on_message_delete(message):
         'author_avatar': str(message.author.avatar.url) if message.author.avatar else None
     }
 
+# Anti-Raid Configuration - a sliding window of joins per guild, with lockdown actions run by a bounded worker pool
+RAID_JOIN_THRESHOLD = 10  # joins
+RAID_TIME_WINDOW = 30  # seconds
+RAID_NEW_ACCOUNT_AGE = timedelta(days=7)
+RAID_NEW_ACCOUNT_SHARE = 0.5  # share of the window's joins that must be new accounts
+RAID_LOCKDOWN_DURATION = 600  # seconds a lockdown lasts after its last suspicious join
+RAID_DEFAULT_ACTION = 'off'  # servers opt in with /antiraid, so a busy event can't mass-timeout real members unannounced
+RAID_TIMEOUT_DURATION = timedelta(hours=1)
+RAID_MUTE_DAYS = 1
+RAID_ACTION_CONCURRENCY = 3
+RAID_ACTION_QUEUE_SIZE = 500
+raid_join_windows = {}  # {guild_id: deque of join entries from the last RAID_TIME_WINDOW seconds}
+raid_lockdowns = {}  # {guild_id: {'until': monotonic time, 'invite_codes': set, 'actioned': set}}
+raid_action_queue = asyncio.Queue(maxsize=RAID_ACTION_QUEUE_SIZE)
+raid_action_workers = []
+
+def get_raid_action(guild_id):
+    """Get what a server does to raid joins: 'timeout', 'mute', 'kick' or 'off'"""
+    return guild_settings.get(guild_id, {}).get('raid_action', RAID_DEFAULT_ACTION)
+
+def get_raid_lockdown(guild_id):
+    """Get a server's lockdown if one is active, clearing it once it has run out"""
+    lockdown = raid_lockdowns.get(guild_id)
+    if lockdown and lockdown['until'] < time.monotonic():
+        del raid_lockdowns[guild_id]
+        logging.info(f"🛡️ Raid lockdown ended in guild {guild_id} after {len(lockdown['actioned'])} action(s)")
+        return None
+    return lockdown
+
+def record_raid_join(member):
+    """Add a join to its server's window, starting a lockdown if the window looks like a raid"""
+    guild_id = member.guild.id
+    now = time.monotonic()
+
+    window = raid_join_windows.setdefault(guild_id, deque())
+    while window and now - window[0]['time'] > RAID_TIME_WINDOW:
+        window.popleft()
+
+    entry = {
+        'time': now,
+        'member': member,
+        'new_account': discord.utils.utcnow() - member.created_at < RAID_NEW_ACCOUNT_AGE,
+        'invite': None  # filled in once the join is attributed
+    }
+    window.append(entry)
+
+    if get_raid_action(guild_id) == 'off':
+        return entry
+
+    lockdown = get_raid_lockdown(guild_id)
+    if lockdown:
+        if entry['new_account']:
+            lockdown['until'] = now + RAID_LOCKDOWN_DURATION
+        return entry
+
+    new_accounts = sum(1 for join in window if join['new_account'])
+    if len(window) >= RAID_JOIN_THRESHOLD and new_accounts >= len(window) * RAID_NEW_ACCOUNT_SHARE:
+        start_raid_lockdown(member.guild, window)
+    return entry
+
+def start_raid_lockdown(guild, window):
+    """Lock a server down and act on every new account already in the join window"""
+    lockdown = raid_lockdowns[guild.id] = {
+        'until': time.monotonic() + RAID_LOCKDOWN_DURATION,
+        'invite_codes': set(),
+        'actioned': set()
+    }
+    logging.warning(f"🚨 Raid detected in {guild.name}: {len(window)} joins in {RAID_TIME_WINDOW}s, "
+                    f"locking down with '{get_raid_action(guild.id)}'")
+
+    for join in window:
+        if join['new_account']:
+            track_raid_invite(lockdown, join['invite'])
+            queue_raid_action(guild, join['member'])
+
+def track_raid_invite(lockdown, invite):
+    """Remember an invite the raid used, so older accounts joining through it are caught too"""
+    # The vanity URL is shared by everyone, so it doesn't mark a join as part of the raid
+    if invite and invite.inviter:
+        lockdown['invite_codes'].add(invite.code)
+
+def check_raid_join(member, entry, invite_used):
+    """Record how a join was attributed and queue a lockdown action for it if it's part of a raid
+
+    Returns True if the join was treated as part of a raid.
+    """
+    entry['invite'] = invite_used
+    lockdown = get_raid_lockdown(member.guild.id)
+    if not lockdown:
+        return False
+
+    if entry['new_account']:
+        track_raid_invite(lockdown, invite_used)
+    elif not (invite_used and invite_used.code in lockdown['invite_codes']):
+        return False
+
+    queue_raid_action(member.guild, member)
+    return True
+
+def queue_raid_action(guild, member):
+    """Queue a server's raid action for a member, once per lockdown"""
+    lockdown = raid_lockdowns[guild.id]
+    if member.id in lockdown['actioned']:
+        return
+    lockdown['actioned'].add(member.id)
+
+    start_raid_action_workers()
+    try:
+        raid_action_queue.put_nowait((member, get_raid_action(guild.id)))
+    except asyncio.QueueFull:
+        logging.warning(f"Raid action queue is full, skipping {member} in {guild.name}")
+
+def start_raid_action_workers():
+    """Start the raid action workers if they aren't already running"""
+    raid_action_workers[:] = [worker for worker in raid_action_workers if not worker.done()]
+    while len(raid_action_workers) < RAID_ACTION_CONCURRENCY:
+        raid_action_workers.append(asyncio.create_task(run_raid_action_worker()))
+
+async def run_raid_action_worker():
+    """Apply queued raid actions one at a time"""
+    while True:
+        member, action = await raid_action_queue.get()
+        try:
+            await apply_raid_action(member, action)
+        except discord.HTTPException as e:
+            logging.error(f"Failed to {action} raid member {member}: {e}")
+        except Exception as e:
+            logging.error(f"Error applying raid action to {member}: {e}")
+        finally:
+            raid_action_queue.task_done()
+
+async def apply_raid_action(member, action):
+    """Time out, mute or kick a member caught in a raid"""
+    reason = "Anti-raid lockdown"
+    if action == 'timeout':
+        await member.timeout(RAID_TIMEOUT_DURATION, reason=reason)
+    elif action == 'mute':
+        if not await apply_mute(member, member.guild, RAID_MUTE_DAYS, reason, save=False):
+            logging.error(f"Could not mute raid member {member} - muted role missing or no permission")
+            return
+    elif action == 'kick':
+        await member.kick(reason=reason)
+    else:
+        return
+    logging.info(f"🛡️ Applied raid action '{action}' to {member} in {member.guild.name}")
+
+@bot.tree.command(name="antiraid", description="Choose what happens to accounts that join during a raid")
+@app_commands.describe(action="What to do to raid joins, or off to stop detecting raids")
+@app_commands.choices(action=[
+    app_commands.Choice(name="Timeout for 1 hour", value="timeout"),
+    app_commands.Choice(name="Muted role for 1 day", value="mute"),
+    app_commands.Choice(name="Kick", value="kick"),
+    app_commands.Choice(name="Off", value="off")
+])
+@app_commands.check(lambda interaction: interaction.user.guild_permissions.administrator)
+async def antiraid(interaction: discord.Interaction, action: str):
+    guild_settings.setdefault(interaction.guild.id, {})['raid_action'] = action
+    if action == 'off':
+        raid_lockdowns.pop(interaction.guild.id, None)
+    save_data()
+
+    if action == 'off':
+        await interaction.response.send_message("✅ Raid detection is now **off**", ephemeral=True)
+    else:
+        await interaction.response.send_message(
+            f"✅ When {RAID_JOIN_THRESHOLD}+ joins arrive within {RAID_TIME_WINDOW}s and {RAID_NEW_ACCOUNT_SHARE:.0%} are new accounts, "
+            f"raid joins will get **{action}**",
+            ephemeral=True
+        )
+
 @bot.event
 async def on_member_join(member):
     """Track when a member joins to attribute to the correct inviter"""
     if member.bot:
         return  # Don't track bots
 
+    # Raid check first - it only needs the account age, so a lockdown starts before invites are fetched
+    raid_entry = record_raid_join(member)
+
     # Get the invite used
     invite_used = await get_invite_used(member)
 
+    if check_raid_join(member, raid_entry, invite_used):
+        return  # Raid joins don't count towards their inviter
+
     if invite_used and invite_used.inviter:
         inviter_id = invite_used.inviter.id
 
@@ -2482,6 +3663,7 @@ async def on_member_join(member):
             invite_counts[inviter_id] = {'invites': 0, 'inviter': None}
 
         invite_counts[inviter_id]['invites'] += 1
+        invalidate_leaderboard('invites')
 
         # Track who was invited by whom
         if member.id not in invite_counts:
@@ -2489,8 +3671,8 @@ async def on_member_join(member):
         else:
             invite_counts[member.id]['inviter'] = inviter_id
 
-        # Save data
-        save_data()
+        # Save data - debounced, so a burst of joins is one write
+        schedule_save_data()
 
         logging.info(f"Member {member} joined using invite from {invite_used.inviter} (now has {invite_counts[inviter_id]['invites']} invites)")
     else:
@@ -2534,13 +3716,131 @@ INVITES_FILE = f"{DATA_DIR}/user_invites.json"
 MESSAGES_FILE = f"{DATA_DIR}/user_messages.json"
 
 # Fix undefined variables
-async def end_giveaway_after_delay(giveaway_id, delay_seconds):
-    """End giveaway after specified delay"""
-    await asyncio.sleep(delay_seconds)
+@bot.event
+async def on_raw_reaction_add(payload):
+    """Record giveaway entries as members react"""
+    if str(payload.emoji) != "🎉" or not payload.member or payload.member.bot:
+        return
 
-    # Check if giveaway still exists and hasn't ended yet
-    if giveaway_id in active_giveaways and not active_giveaways[giveaway_id].get('ended', False):
-        await end_giveaway(giveaway_id)
+    giveaway = active_giveaways.get(payload.message_id)
+    if not giveaway or giveaway.get('ended') or 'entrants' not in giveaway:
+        return  # Not a giveaway, or one from before entries were tracked (its reactions are read at the end)
+
+    # Eligibility is evaluated now so ending the giveaway only has to draw
+    weight = get_giveaway_entry_weight(giveaway, payload.member)
+    giveaway['entrants'][str(payload.user_id)] = weight
+    record_giveaway_entrant(payload.message_id, str(payload.user_id), weight)
+    schedule_save_data()
+
+@bot.event
+async def on_raw_reaction_remove(payload):
+    """Drop giveaway entries when members take their reaction back"""
+    if str(payload.emoji) != "🎉":
+        return
+
+    giveaway = active_giveaways.get(payload.message_id)
+    if not giveaway or giveaway.get('ended') or 'entrants' not in giveaway:
+        return
+
+    if giveaway['entrants'].pop(str(payload.user_id), None) is not None:
+        record_giveaway_entrant(payload.message_id, str(payload.user_id), None)
+        schedule_save_data()
+
+# Startup catch-up - giveaways that came due during downtime are ended a few at a time
+GIVEAWAY_CATCH_UP_CONCURRENCY = 3
+GIVEAWAY_CATCH_UP_LOG_EVERY = 10
+giveaways_catching_up = set()  # ids queued for catch-up, so a reconnect doesn't queue them twice
+
+def start_giveaway_catch_up(giveaway_ids):
+    """Start ending overdue giveaways in the background"""
+    giveaway_ids = [giveaway_id for giveaway_id in giveaway_ids if giveaway_id not in giveaways_catching_up]
+    if giveaway_ids:
+        giveaways_catching_up.update(giveaway_ids)
+        start_background_task(catch_up_overdue_giveaways(giveaway_ids))
+
+async def catch_up_overdue_giveaways(giveaway_ids):
+    """End giveaways that came due while the bot was offline, with bounded concurrency"""
+    logging.info(f"⏰ Catching up on {len(giveaway_ids)} overdue giveaway(s)")
+    semaphore = asyncio.Semaphore(GIVEAWAY_CATCH_UP_CONCURRENCY)
+    finished = 0
+
+    async def catch_up(giveaway_id):
+        nonlocal finished
+        async with semaphore:
+            try:
+                if giveaway_id in active_giveaways and not active_giveaways[giveaway_id].get('ended', False):
+                    await end_giveaway(giveaway_id)
+            except Exception as e:
+                logging.error(f"Error ending overdue giveaway {giveaway_id}: {e}")
+            finally:
+                giveaways_catching_up.discard(giveaway_id)
+
+        finished += 1
+        if finished % GIVEAWAY_CATCH_UP_LOG_EVERY == 0 or finished == len(giveaway_ids):
+            logging.info(f"⏰ Caught up on {finished}/{len(giveaway_ids)} overdue giveaway(s)")
+
+    await asyncio.gather(*(catch_up(giveaway_id) for giveaway_id in giveaway_ids))
+
+# Giveaway scheduler - a single task sleeps until the soonest end time instead of one task per giveaway
+giveaway_schedule = []  # min-heap of (end_time, giveaway_id), may hold stale entries
+giveaway_end_times = {}  # {giveaway_id: end_time} - the live schedule; heap entries that don't match it are skipped
+giveaway_scheduler_wakeup = asyncio.Event()
+giveaway_scheduler_task = None
+
+def start_giveaway_scheduler():
+    """Start the giveaway scheduler task if it isn't already running"""
+    global giveaway_scheduler_task
+    if giveaway_scheduler_task is None or giveaway_scheduler_task.done():
+        giveaway_scheduler_task = asyncio.create_task(run_giveaway_scheduler())
+
+def schedule_giveaway_end(giveaway_id, end_time):
+    """Schedule a giveaway to end at end_time, replacing any earlier schedule for it"""
+    if giveaway_end_times.get(giveaway_id) == end_time:
+        return  # already scheduled, e.g. load_data running again on reconnect
+
+    giveaway_end_times[giveaway_id] = end_time
+    heapq.heappush(giveaway_schedule, (end_time, giveaway_id))
+
+    start_giveaway_scheduler()
+    giveaway_scheduler_wakeup.set()  # the new end time may be sooner than what the scheduler sleeps on
+
+def cancel_giveaway_end(giveaway_id):
+    """Stop a giveaway from being ended by the scheduler"""
+    # The heap entry is left behind and skipped once it reaches the top
+    giveaway_end_times.pop(giveaway_id, None)
+
+async def run_giveaway_scheduler():
+    """End giveaways as their end times come up"""
+    while True:
+        # Drop cancelled and rescheduled entries
+        while giveaway_schedule and giveaway_end_times.get(giveaway_schedule[0][1]) != giveaway_schedule[0][0]:
+            heapq.heappop(giveaway_schedule)
+
+        giveaway_scheduler_wakeup.clear()
+
+        if not giveaway_schedule:
+            await giveaway_scheduler_wakeup.wait()
+            continue
+
+        end_time, giveaway_id = giveaway_schedule[0]
+        delay_seconds = (end_time - datetime.utcnow()).total_seconds()
+        if delay_seconds > 0:
+            # Sleep until it's due, or until a sooner giveaway is scheduled
+            try:
+                await asyncio.wait_for(giveaway_scheduler_wakeup.wait(), timeout=delay_seconds)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        heapq.heappop(giveaway_schedule)
+        del giveaway_end_times[giveaway_id]
+
+        # Check if giveaway still exists and hasn't ended yet
+        if giveaway_id in active_giveaways and not active_giveaways[giveaway_id].get('ended', False):
+            try:
+                await end_giveaway(giveaway_id)
+            except Exception as e:
+                logging.error(f"Error ending giveaway {giveaway_id}: {e}")
 
 @bot.tree.command(name="userinfo", description="Get detailed information about a user")
 @app_commands.describe(user="The user to get info about (optional - defaults to yourself)")
@@ -2829,27 +4129,39 @@ async def prefix_check_rank(ctx, user: discord.Member = None):
     await ctx.send(embed=embed)
 
 @bot.tree.command(name="level-leaderboard", description="Show the server XP leaderboard")
-async def level_leaderboard(interaction: discord.Interaction):
+@app_commands.describe(page="Leaderboard page (default: 1)")
+async def level_leaderboard(interaction: discord.Interaction, page: app_commands.Range[int, 1, 100] = 1):
     if not user_levels:
         await interaction.response.send_message("❌ No one has earned XP yet!", ephemeral=True)
         return
 
+    cached_embed = get_cached_leaderboard(interaction.guild.id, 'levels', None, page)
+    if cached_embed:
+        await interaction.response.send_message(embed=cached_embed)
+        return
+
     # Sort users by XP
     sorted_users = sorted(user_levels.items(), key=lambda x: x[1]['xp'], reverse=True)
+    offset, top_users = get_leaderboard_page(sorted_users, page)
+
+    if not top_users:
+        await interaction.response.send_message("❌ That page is empty!", ephemeral=True)
+        return
 
     embed = discord.Embed(
         title="🏆 XP Leaderboard",
         color=0xffd700
     )
 
-    leaderboard_text = ""
-    for i, (user_id, data) in enumerate(sorted_users[:10]):  # Top 10
+    leaderboard_lines = []
+    for i, (user_id, data) in enumerate(top_users, start=offset):
         user = interaction.guild.get_member(user_id)
         if user:
             medal = "🥇" if i == 0 else "🥈" if i == 1 else "🥉" if i == 2 else f"#{i+1}"
-            leaderboard_text += f"{medal} **{user.display_name}** - Level {data['level']} ({data['xp']:,} XP)\n"
+            leaderboard_lines.append(f"{medal} **{user.display_name}** - Level {data['level']} ({data['xp']:,} XP)")
 
-    embed.description = leaderboard_text or "No users found!"
+    embed.description = "\n".join(leaderboard_lines) or "No users found!"
+    cache_leaderboard(interaction.guild.id, 'levels', None, page, embed, top_users, lambda row: row[1]['xp'])
 
     await interaction.response.send_message(embed=embed)
 
@@ -2876,22 +4188,138 @@ async def rank_card(interaction: discord.Interaction, user: discord.Member = Non
         sorted_users = sorted(user_levels.items(), key=lambda x: x[1]['xp'], reverse=True)
         rank_position = next((i + 1 for i, (uid, _) in enumerate(sorted_users) if uid == target_user.id), 0)
         
-        # Get guild icon
-        guild_icon_url = interaction.guild.icon.url if interaction.guild.icon else ""
-        
-        # Generate rank card
-        card_image = generate_rank_card(target_user, level, current_xp, xp_for_current, xp_for_next, rank_position, guild_icon_url)
+        # Reuse the last render if nothing on the card has changed
+        image_format, max_bytes = get_rank_card_encoding(interaction.guild.id)
+        cache_key = get_rank_card_cache_key(target_user, interaction.guild, level, current_xp,
+                                            xp_for_current, xp_for_next, rank_position,
+                                            image_format=image_format, max_bytes=max_bytes)
+        card = get_cached_rank_card(cache_key)
+
+        if card is None:
+            # Fetch the avatar and guild icon concurrently (cached after the first card)
+            avatar_image, guild_icon_image = await asyncio.gather(
+                fetch_rank_card_asset(target_user.display_avatar, RANK_CARD_AVATAR_SIZE),
+                fetch_rank_card_asset(interaction.guild.icon, RANK_CARD_ICON_SIZE)
+            )
+
+            # Generate rank card in the render pool
+            card_request = RankCardRequest(
+                username=target_user.name,
+                level=level,
+                current_xp=current_xp,
+                xp_for_current=xp_for_current,
+                xp_for_next=xp_for_next,
+                rank_position=rank_position,
+                avatar_image=avatar_image,
+                guild_icon_image=guild_icon_image,
+                image_format=image_format,
+                max_bytes=max_bytes
+            )
+            card = await run_render_job(generate_rank_card, card_request)
+            if card is None:
+                await interaction.followup.send("⏳ Rank cards are busy right now, please try again in a few seconds!", ephemeral=True)
+                return
+            record_render_metrics('rank', card)
+
+            # Cards missing an avatar or icon because a fetch failed shouldn't stick around
+            if (avatar_image is not None) and (guild_icon_image is not None or not interaction.guild.icon):
+                cache_rank_card(cache_key, card)
         
         # Send as file
-        file = discord.File(card_image, filename="rankcard.png")
+        filename = f"rankcard.{card.extension}"
+        file = discord.File(BytesIO(card.data), filename=filename)
         embed = discord.Embed(title=f"{target_user.display_name}'s Rank Card", color=0x00ff00)
-        embed.set_image(url="attachment://rankcard.png")
+        embed.set_image(url=f"attachment://{filename}")
         
         await interaction.followup.send(embed=embed, file=file)
     except Exception as e:
         logging.error(f"Error generating rank card: {e}")
         await interaction.followup.send(f"❌ Error generating rank card: {str(e)}", ephemeral=True)
 
+@bot.tree.command(name="leaderboard-card", description="Show the XP leaderboard as an image")
+@app_commands.describe(count="How many members to show (default: 10)")
+async def leaderboard_card(interaction: discord.Interaction, count: app_commands.Range[int, 3, 15] = 10):
+    if not user_levels:
+        await interaction.response.send_message("❌ No one has earned XP yet!", ephemeral=True)
+        return
+
+    await interaction.response.defer()
+
+    try:
+        # Take the top members who are still in this server
+        sorted_users = sorted(user_levels.items(), key=lambda x: x[1]['xp'], reverse=True)
+        top_members = []
+        for i, (user_id, data) in enumerate(sorted_users):
+            member = interaction.guild.get_member(user_id)
+            if member:
+                top_members.append((i + 1, member, data))
+                if len(top_members) >= count:
+                    break
+
+        if not top_members:
+            await interaction.followup.send("❌ No users found!", ephemeral=True)
+            return
+
+        # Fetch every avatar concurrently through the shared asset cache
+        avatar_images = await asyncio.gather(*(
+            fetch_rank_card_asset(member.display_avatar, LEADERBOARD_AVATAR_SIZE)
+            for _, member, _ in top_members
+        ))
+
+        rows = [
+            LeaderboardCardRow(
+                rank_position=rank_position,
+                username=member.name,
+                level=data['level'],
+                current_xp=data['xp'],
+                xp_for_current=calculate_xp_for_level(data['level']),
+                xp_for_next=calculate_xp_for_level(data['level'] + 1),
+                avatar_image=avatar_image
+            )
+            for (rank_position, member, data), avatar_image in zip(top_members, avatar_images)
+        ]
+
+        # Draw the whole board in a single render job
+        image_format, max_bytes = get_rank_card_encoding(interaction.guild.id)
+        card_request = LeaderboardCardRequest(rows=rows, image_format=image_format, max_bytes=max_bytes)
+        card = await run_render_job(generate_leaderboard_card, card_request)
+        if card is None:
+            await interaction.followup.send("⏳ Leaderboard images are busy right now, please try again in a few seconds!", ephemeral=True)
+            return
+        record_render_metrics('leaderboard', card)
+
+        filename = f"leaderboard.{card.extension}"
+        file = discord.File(BytesIO(card.data), filename=filename)
+        embed = discord.Embed(title="🏆 XP Leaderboard", color=0xffd700)
+        embed.set_image(url=f"attachment://{filename}")
+
+        await interaction.followup.send(embed=embed, file=file)
+    except Exception as e:
+        logging.error(f"Error generating leaderboard card: {e}")
+        await interaction.followup.send(f"❌ Error generating leaderboard card: {str(e)}", ephemeral=True)
+
+@bot.tree.command(name="rankcard-format", description="Choose how rank card images are encoded for this server")
+@app_commands.describe(
+    image_format="PNG is sharpest, WebP and palette PNG upload faster",
+    max_kb="Largest card size in KB, stepping down quality to fit (0 for no limit)"
+)
+@app_commands.choices(image_format=[
+    app_commands.Choice(name="PNG", value="png"),
+    app_commands.Choice(name="Optimized PNG", value="png-optimized"),
+    app_commands.Choice(name="Palette PNG (256 colours)", value="png-palette"),
+    app_commands.Choice(name="WebP", value="webp")
+])
+@app_commands.check(lambda interaction: interaction.user.guild_permissions.administrator)
+async def rankcard_format(interaction: discord.Interaction, image_format: str, max_kb: app_commands.Range[int, 0, 8192] = 0):
+    guild_settings.setdefault(interaction.guild.id, {}).update({
+        'rank_card_format': image_format,
+        'rank_card_max_bytes': max_kb * 1024 or None
+    })
+    save_data()
+
+    limit_text = f" with a {max_kb} KB limit" if max_kb else ""
+    await interaction.response.send_message(f"✅ Rank cards will now be sent as **{image_format}**{limit_text}", ephemeral=True)
+
 # Music Player (using yt-dlp)
 music_queue = {}  # {guild_id: {'queue': [], 'now_playing': None, 'vc': voice_client}}
 
@@ -3405,6 +4833,19 @@ async def manual_winner(interaction: discord.Interaction):
 
 # Run the bot
 if __name__ == "__main__":
+    # Fork the render workers before MongoDB's monitor threads and Flask exist - a worker forked from a process
+    # with other threads can inherit a lock (logging, pymongo, the allocator) that no thread will ever release
+    if 'fork' in multiprocessing.get_all_start_methods():
+        start_render_pool()
+
+    load_environment()
+    connect_database()
+    os.makedirs(DATA_DIR, exist_ok=True)
+
+    rank_card_font_path = discover_rank_card_font()
+    if rank_card_font_path:
+        logging.info(f"🖋️ Rank cards will use font {rank_card_font_path}")
+
     keep_alive()
     if not TOKEN:
         logging.warning("TOKEN environment variable not set - Flask server running but bot is disabled")
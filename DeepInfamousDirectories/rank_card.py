@@ -0,0 +1,490 @@
+"""Rank card rendering
+
+Kept free of Discord and bot state so cards can be drawn inside the render process pool.
+"""
+import logging
+import os
+import time
+from dataclasses import dataclass
+from io import BytesIO
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont, features
+
+# Card layout
+CARD_WIDTH, CARD_HEIGHT = 700, 250
+BAR_X, BAR_Y = 140, 120
+BAR_WIDTH, BAR_HEIGHT = 500, 25
+
+# Colours for the static parts of the card, per theme
+RANK_CARD_THEMES = {
+    'default': {
+        'background_top': (25, 30, 40),
+        'background_shift': (30, 35, 60),  # added to the top colour by the bottom of the card
+        'banner': (70, 80, 150, 180),
+        'level_badge_top': (88, 101, 242),  # Discord blurple
+        'level_badge_bottom': (155, 89, 182),  # Purple
+        'bar_background_left': (60, 60, 80),
+        'bar_background_shift': (40, 30, 20),  # added to the left colour by the end of the bar
+        'outer_border': (100, 150, 255)
+    }
+}
+
+# Fonts - an explicit RANK_CARD_FONT path wins, otherwise the first usable system font is used
+RANK_CARD_FONT = os.getenv("RANK_CARD_FONT")
+FONT_SEARCH_PATHS = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+    "/usr/share/fonts/TTF/DejaVuSans-Bold.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans-Bold.ttf",
+    "/System/Library/Fonts/Supplemental/Arial Bold.ttf",
+    "/Library/Fonts/Arial.ttf",
+    "C:\\Windows\\Fonts\\arialbd.ttf",
+    "C:\\Windows\\Fonts\\arial.ttf",
+    # Bare names make Pillow search its own font directories, which is slow, so they go last
+    "arial.ttf",
+    "DejaVuSans.ttf"
+]
+_font_path = None
+_font_path_discovered = False
+_font_cache = {}  # {size: FreeTypeFont}
+
+# Pre-rendered static layers, built once per process
+_template_cache = {}  # {(theme, width, height): Image}
+
+# Output encodings - {name: (Pillow format, file extension)}
+IMAGE_FORMATS = {
+    'png': ('PNG', 'png'),  # Pillow defaults, fastest to encode
+    'png-optimized': ('PNG', 'png'),  # same pixels, smaller file, slower encode
+    'png-palette': ('PNG', 'png'),  # quantized to 256 colours, much smaller
+    'webp': ('WEBP', 'webp')  # lossy, smallest
+}
+WEBP_QUALITY_STEPS = [90, 80, 70, 60, 50, 40]  # tried in order until the output fits the byte budget
+
+
+@dataclass
+class RankCardRequest:
+    """Everything that ends up on a rank card, picklable so it can be sent to a worker process"""
+    username: str
+    level: int
+    current_xp: int
+    xp_for_current: int
+    xp_for_next: int
+    rank_position: int
+    theme: str = 'default'
+    avatar_image: Image.Image | None = None  # pre-masked, see mask_circle
+    guild_icon_image: Image.Image | None = None  # pre-masked, see mask_circle
+    image_format: str = 'png'  # see IMAGE_FORMATS
+    max_bytes: int | None = None  # byte budget for the encoded card, None for no limit
+
+
+@dataclass
+class LeaderboardCardRow:
+    """One member's line on a leaderboard card"""
+    rank_position: int
+    username: str
+    level: int
+    current_xp: int
+    xp_for_current: int
+    xp_for_next: int
+    avatar_image: Image.Image | None = None  # pre-masked, see mask_circle
+
+
+@dataclass
+class LeaderboardCardRequest:
+    """A whole leaderboard drawn as a single image in one render job"""
+    rows: list[LeaderboardCardRow]
+    title: str = "XP Leaderboard"
+    theme: str = 'default'
+    image_format: str = 'png'  # see IMAGE_FORMATS
+    max_bytes: int | None = None  # byte budget for the encoded card, None for no limit
+
+
+@dataclass
+class EncodedImage:
+    """A rendered card plus what it took to encode it"""
+    data: bytes
+    image_format: str  # the format actually used, which can differ from the requested one
+    extension: str
+    encode_seconds: float
+
+
+def mask_circle(image, size):
+    """Resize an image to size x size and cut it into a circle via its alpha channel"""
+    image = image.convert('RGBA').resize((size, size), Image.Resampling.LANCZOS)
+
+    mask = Image.new('L', (size, size), 0)
+    mask_draw = ImageDraw.Draw(mask)
+    mask_draw.ellipse([0, 0, size, size], fill=255)
+    image.putalpha(mask)
+
+    return image
+
+
+def discover_rank_card_font():
+    """Find a usable TrueType font once and remember it, returning its path or None"""
+    global _font_path, _font_path_discovered
+    if _font_path_discovered:
+        return _font_path
+
+    candidates = ([RANK_CARD_FONT] if RANK_CARD_FONT else []) + FONT_SEARCH_PATHS
+    for path in candidates:
+        try:
+            ImageFont.truetype(path, 12)
+        except OSError:
+            continue
+        _font_path = path
+        break
+    else:
+        logging.warning("No TrueType font found for rank cards - falling back to Pillow's default font")
+
+    _font_path_discovered = True
+    return _font_path
+
+
+def init_render_worker(font_path):
+    """Process pool initializer - reuse the font the bot already found instead of searching again"""
+    global _font_path, _font_path_discovered
+    _font_path = font_path
+    _font_path_discovered = True
+
+
+def get_font(size):
+    """Get the rank card font at a given size, loading each size only once"""
+    font = _font_cache.get(size)
+    if font is None:
+        font_path = discover_rank_card_font()
+        if font_path:
+            font = ImageFont.truetype(font_path, size)
+        else:
+            try:
+                font = ImageFont.load_default(size)
+            except TypeError:
+                # Pillow < 10.1 can't scale the default font
+                font = ImageFont.load_default()
+        _font_cache[size] = font
+    return font
+
+
+def fit_font(draw, text, font, max_width):
+    """Shrink a registry font until text fits in max_width pixels"""
+    if not isinstance(font, ImageFont.FreeTypeFont):
+        return font  # the bitmap fallback font can't be resized
+
+    size = int(font.size)
+    while size > 10 and draw.textlength(text, font=font) > max_width:
+        size -= 2
+        font = get_font(size)
+    return font
+
+
+def get_progress_width(current_xp, xp_for_current, xp_for_next):
+    """Get how many pixels of the XP bar are filled"""
+    xp_in_level = current_xp - xp_for_current
+    xp_needed = xp_for_next - xp_for_current
+    return int((xp_in_level / xp_needed) * BAR_WIDTH) if xp_needed > 0 else 0
+
+
+def rainbow_gradient(width, height):
+    """Build a red -> yellow -> green -> cyan -> blue -> magenta -> red gradient as an RGB array
+
+    Matches the old per-column loop exactly, so cards look the same.
+    """
+    hue_pos = (np.arange(width) / width) * 6
+    segment = np.minimum(hue_pos.astype(np.int64), 5)
+    rising = (255 * (hue_pos - segment)).astype(np.int64)  # 0 -> 255 across a segment
+    falling = (255 * (segment + 1 - hue_pos)).astype(np.int64)  # 255 -> 0 across a segment
+
+    # Each segment holds one channel at 255, ramps another and keeps the third at 0
+    full = np.full(width, 255, dtype=np.int64)
+    zero = np.zeros(width, dtype=np.int64)
+    r = np.choose(segment, [full, falling, zero, zero, rising, full])
+    g = np.choose(segment, [rising, full, full, falling, zero, zero])
+    b = np.choose(segment, [zero, zero, rising, full, full, falling])
+
+    column = np.stack([r, g, b], axis=-1).astype(np.uint8)
+    return np.ascontiguousarray(np.broadcast_to(column, (height, width, 3)))
+
+
+def draw_card_background(draw, width, height, colors):
+    """Draw the themed background gradient and top/bottom banners"""
+    # Create a more colorful background
+    # Draw a gradient background from top to bottom
+    top, shift = colors['background_top'], colors['background_shift']
+    for y in range(height):
+        # Create a gradient from dark blue to lighter blue/purple
+        r = int(top[0] + (y / height) * shift[0])
+        g = int(top[1] + (y / height) * shift[1])
+        b = int(top[2] + (y / height) * shift[2])
+        draw.line([(0, y), (width, y)], fill=(r, g, b))
+
+    # Draw a decorative background element
+    draw.rectangle([0, 0, width, 30], fill=colors['banner'])  # Top banner
+    draw.rectangle([0, height-30, width, height], fill=colors['banner'])  # Bottom banner
+
+
+def render_rank_card_template(theme):
+    """Draw every part of the card that doesn't depend on the user"""
+    colors = RANK_CARD_THEMES[theme]
+    width, height = CARD_WIDTH, CARD_HEIGHT
+    card = Image.new('RGB', (width, height))
+    draw = ImageDraw.Draw(card)
+
+    draw_card_background(draw, width, height, colors)
+
+    # Draw level badge with gradient background
+    level_bg_top = colors['level_badge_top']
+    level_bg_bottom = colors['level_badge_bottom']
+    # Draw gradient rectangle for level badge
+    for y in range(30, 80):
+        gradient_factor = (y - 30) / (80 - 30)
+        r = int(level_bg_top[0] + (level_bg_bottom[0] - level_bg_top[0]) * gradient_factor)
+        g = int(level_bg_top[1] + (level_bg_bottom[1] - level_bg_top[1]) * gradient_factor)
+        b = int(level_bg_top[2] + (level_bg_bottom[2] - level_bg_top[2]) * gradient_factor)
+        draw.line([(550, y), (670, y)], fill=(r, g, b))
+
+    # Draw rounded corners for level badge
+    draw.rounded_rectangle([550, 30, 670, 80], radius=15, fill=None, outline=(255, 255, 255), width=2)
+
+    # Draw gradient background bar
+    left, shift = colors['bar_background_left'], colors['bar_background_shift']
+    for x in range(BAR_WIDTH):
+        gradient_pos = x / BAR_WIDTH
+        r = int(left[0] + gradient_pos * shift[0])
+        g = int(left[1] + gradient_pos * shift[1])
+        b = int(left[2] + gradient_pos * shift[2])
+        draw.line([(BAR_X + x, BAR_Y), (BAR_X + x, BAR_Y + BAR_HEIGHT)], fill=(r, g, b))
+
+    # Add a subtle outer border
+    draw.rectangle([0, 0, width-1, height-1], outline=colors['outer_border'], width=3)
+
+    return card
+
+
+def get_rank_card_template(theme='default'):
+    """Get a fresh copy of the static card layers, rendering them on first use"""
+    key = (theme, CARD_WIDTH, CARD_HEIGHT)
+    template = _template_cache.get(key)
+    if template is None:
+        template = _template_cache[key] = render_rank_card_template(theme)
+    return template.copy()
+
+
+def encode_with_format(image, image_format, quality=None):
+    """Encode an image with one of the IMAGE_FORMATS and return the bytes"""
+    img_bytes = BytesIO()
+    if image_format == 'png':
+        image.save(img_bytes, format='PNG')
+    elif image_format == 'png-optimized':
+        image.save(img_bytes, format='PNG', optimize=True)
+    elif image_format == 'png-palette':
+        image.quantize(colors=256, method=Image.Quantize.FASTOCTREE).save(img_bytes, format='PNG', optimize=True)
+    elif image_format == 'webp':
+        image.save(img_bytes, format='WEBP', quality=quality or WEBP_QUALITY_STEPS[0], method=4)
+    else:
+        raise ValueError(f"Unknown image format: {image_format}")
+    return img_bytes.getvalue()
+
+
+def encode_image(image, image_format='png', max_bytes=None) -> EncodedImage:
+    """Encode a card, stepping down to smaller encodings until it fits max_bytes
+
+    PNG formats fall back to palette PNG and then WebP; WebP steps its quality down. If nothing
+    fits, the smallest attempt is returned.
+    """
+    start = time.perf_counter()
+
+    if image_format == 'webp' and not features.check('webp'):
+        image_format = 'png-optimized'  # Pillow built without libwebp
+
+    attempts = [(image_format, WEBP_QUALITY_STEPS[0] if image_format == 'webp' else None)]
+    if max_bytes:
+        if image_format in ('png', 'png-optimized'):
+            attempts.append(('png-palette', None))
+        if features.check('webp'):
+            attempts += [('webp', quality) for quality in WEBP_QUALITY_STEPS]
+
+    best_format, best_data = None, None
+    for attempt_format, quality in dict.fromkeys(attempts):
+        data = encode_with_format(image, attempt_format, quality)
+        if best_data is None or len(data) < len(best_data):
+            best_format, best_data = attempt_format, data
+        if not max_bytes or len(data) <= max_bytes:
+            best_format, best_data = attempt_format, data
+            break
+
+    return EncodedImage(
+        data=best_data,
+        image_format=best_format,
+        extension=IMAGE_FORMATS[best_format][1],
+        encode_seconds=time.perf_counter() - start
+    )
+
+
+def generate_rank_card(request: RankCardRequest) -> EncodedImage:
+    """Generate a beautiful rank card image and return it encoded as the request asks
+
+    Only the parts that change per user are drawn here; the rest comes from the theme template.
+    """
+    avatar_image = request.avatar_image
+    guild_icon_image = request.guild_icon_image
+
+    width, height = CARD_WIDTH, CARD_HEIGHT
+    card = get_rank_card_template(request.theme)
+    draw = ImageDraw.Draw(card)
+
+    # Load fonts from the registry (discovered once, cached per size)
+    name_font = get_font(30)
+    level_font = get_font(40)
+    stat_font = get_font(16)
+    small_stat_font = get_font(14)
+
+    # Draw user avatar (circle)
+    if avatar_image:
+        # Create a colorful border for the avatar
+        border_radius = 55
+        border_center_x, border_center_y = 77, 80  # Center of avatar position
+        draw.ellipse([border_center_x - border_radius, border_center_y - border_radius,
+                      border_center_x + border_radius, border_center_y + border_radius],
+                     outline=(255, 215, 0), width=4)  # Gold border
+
+        # Paste avatar
+        card.paste(avatar_image, (27, 30), avatar_image)
+
+    # Draw username with shadow effect (shadow first so it sits behind the text)
+    username = request.username[:20]
+    name_font = fit_font(draw, username, name_font, 400)  # keep clear of the level badge
+    draw.text((141, 36), username, font=name_font, fill=(0, 0, 0, 128))
+    draw.text((140, 35), username, font=name_font, fill=(255, 255, 255))
+
+    # Draw level text centred on the pre-rendered badge
+    level_text = f"LVL {request.level}"
+    level_font = fit_font(draw, level_text, level_font, 104)
+    level_bbox = draw.textbbox((0, 0), level_text, font=level_font)
+    level_x = 610 - (level_bbox[0] + level_bbox[2]) // 2
+    level_y = 55 - (level_bbox[1] + level_bbox[3]) // 2
+    draw.text((level_x, level_y), level_text, font=level_font, fill=(255, 255, 255))
+
+    # Draw rank position with gold color
+    rank_text = f"#{request.rank_position}"
+    draw.text((140, 75), f"Rank: {rank_text}", font=stat_font, fill=(255, 215, 0))  # Gold color
+
+    # Draw XP progress with colorful gradient over the pre-rendered bar background
+    bar_width = BAR_WIDTH
+    bar_height = BAR_HEIGHT
+    bar_x = BAR_X
+    bar_y = BAR_Y
+
+    xp_in_level = request.current_xp - request.xp_for_current
+    xp_needed = request.xp_for_next - request.xp_for_current
+    progress_width = get_progress_width(request.current_xp, request.xp_for_current, request.xp_for_next)
+    if progress_width > 0:
+        # Draw progress with rainbow-like gradient
+        progress_fill = Image.fromarray(rainbow_gradient(progress_width, bar_height + 1), 'RGB')
+        card.paste(progress_fill, (bar_x, bar_y))
+
+    # Draw border around XP bar
+    draw.rounded_rectangle([bar_x, bar_y, bar_x + bar_width, bar_y + bar_height], radius=12, outline=(255, 255, 255), width=2)
+
+    # XP text overlay (centered in the progress bar)
+    xp_text = f"{xp_in_level:,} / {xp_needed:,} XP"
+    text_bbox = draw.textbbox((0, 0), xp_text, font=small_stat_font)
+    text_width = text_bbox[2] - text_bbox[0]
+    text_x = bar_x + (bar_width - text_width) // 2
+    draw.text((text_x, bar_y + 5), xp_text, font=small_stat_font, fill=(255, 255, 255))
+
+    # Draw total XP
+    total_xp_text = f"Total XP: {request.current_xp:,}"
+    draw.text((140, 160), total_xp_text, font=stat_font, fill=(200, 230, 255))  # Light blue
+
+    # Draw server icon with circular frame
+    if guild_icon_image:
+        logo_size = guild_icon_image.width
+
+        # Create a frame for the server icon
+        icon_frame_x, icon_frame_y = width - 80, height - 80
+        draw.ellipse([icon_frame_x - 5, icon_frame_y - 5,
+                      icon_frame_x + logo_size + 5, icon_frame_y + logo_size + 5],
+                     outline=(255, 215, 0), width=3)  # Gold frame
+
+        # Paste server icon
+        card.paste(guild_icon_image, (icon_frame_x, icon_frame_y), guild_icon_image)
+
+    return encode_image(card, request.image_format, request.max_bytes)
+
+
+# Leaderboard card layout
+LEADERBOARD_HEADER_HEIGHT = 45
+LEADERBOARD_ROW_HEIGHT = 64
+LEADERBOARD_FOOTER_HEIGHT = 40
+LEADERBOARD_AVATAR_SIZE = 48
+LEADERBOARD_BAR_WIDTH = 330
+RANK_COLORS = {1: (255, 215, 0), 2: (192, 192, 192), 3: (205, 127, 50)}  # Gold, silver, bronze
+
+
+def generate_leaderboard_card(request: LeaderboardCardRequest) -> EncodedImage:
+    """Draw a top-N leaderboard as one image and return it encoded as the request asks"""
+    colors = RANK_CARD_THEMES[request.theme]
+    width = CARD_WIDTH
+    height = LEADERBOARD_HEADER_HEIGHT + LEADERBOARD_ROW_HEIGHT * len(request.rows) + LEADERBOARD_FOOTER_HEIGHT
+    card = Image.new('RGB', (width, height))
+    draw = ImageDraw.Draw(card)
+
+    draw_card_background(draw, width, height, colors)
+
+    title_font = get_font(20)
+    name_font = get_font(20)
+    rank_font = get_font(22)
+    stat_font = get_font(14)
+
+    # Title centred in the top banner
+    title_bbox = draw.textbbox((0, 0), request.title, font=title_font)
+    draw.text(((width - (title_bbox[0] + title_bbox[2])) // 2, 15 - (title_bbox[1] + title_bbox[3]) // 2),
+              request.title, font=title_font, fill=(255, 255, 255))
+
+    for index, row in enumerate(request.rows):
+        row_y = LEADERBOARD_HEADER_HEIGHT + index * LEADERBOARD_ROW_HEIGHT
+        draw.rounded_rectangle([15, row_y, width - 15, row_y + LEADERBOARD_ROW_HEIGHT - 8], radius=12,
+                               fill=(40, 46, 72), outline=colors['level_badge_top'], width=1)
+
+        # Rank number, medal coloured for the podium
+        rank_text = f"#{row.rank_position}"
+        draw.text((26, row_y + 14), rank_text, font=fit_font(draw, rank_text, rank_font, 54),
+                  fill=RANK_COLORS.get(row.rank_position, (255, 255, 255)))
+
+        # Avatar with the same gold ring as the rank card
+        avatar_x, avatar_y = 86, row_y + 4
+        if row.avatar_image:
+            draw.ellipse([avatar_x - 2, avatar_y - 2, avatar_x + LEADERBOARD_AVATAR_SIZE + 2, avatar_y + LEADERBOARD_AVATAR_SIZE + 2],
+                         outline=(255, 215, 0), width=2)
+            card.paste(row.avatar_image, (avatar_x, avatar_y), row.avatar_image)
+
+        # Name and progress through the current level
+        username = row.username[:20]
+        row_name_font = fit_font(draw, username, name_font, LEADERBOARD_BAR_WIDTH)
+        draw.text((148, row_y + 6), username, font=row_name_font, fill=(255, 255, 255))
+
+        bar_x, bar_y = 148, row_y + 36
+        draw.rounded_rectangle([bar_x, bar_y, bar_x + LEADERBOARD_BAR_WIDTH, bar_y + 10], radius=5,
+                               fill=colors['bar_background_left'])
+        progress_width = get_progress_width(row.current_xp, row.xp_for_current, row.xp_for_next)
+        progress_width = min(LEADERBOARD_BAR_WIDTH, progress_width * LEADERBOARD_BAR_WIDTH // BAR_WIDTH)
+        if progress_width > 0:
+            progress_fill = Image.fromarray(rainbow_gradient(progress_width, 11), 'RGB')
+            card.paste(progress_fill, (bar_x, bar_y))
+        draw.rounded_rectangle([bar_x, bar_y, bar_x + LEADERBOARD_BAR_WIDTH, bar_y + 10], radius=5,
+                               outline=(255, 255, 255), width=1)
+
+        # Level and total XP, right-aligned
+        level_text = f"LVL {row.level}"
+        xp_text = f"{row.current_xp:,} XP"
+        draw.text((width - 30 - draw.textlength(level_text, font=name_font), row_y + 6), level_text,
+                  font=name_font, fill=(255, 255, 255))
+        draw.text((width - 30 - draw.textlength(xp_text, font=stat_font), row_y + 34), xp_text,
+                  font=stat_font, fill=(200, 230, 255))
+
+    # Add a subtle outer border
+    draw.rectangle([0, 0, width-1, height-1], outline=colors['outer_border'], width=3)
+
+    return encode_image(card, request.image_format, request.max_bytes)
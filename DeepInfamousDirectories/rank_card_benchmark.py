@@ -0,0 +1,368 @@
+"""Offline benchmark for rank card rendering
+
+Renders rank cards with stubbed avatar/icon bytes (no Discord, no network) and reports
+per-card latency, peak RSS and output size across levels and XP-bar widths.
+
+Usage:
+    python rank_card_benchmark.py
+    python rank_card_benchmark.py --modes legacy inline --iterations 50 --output results.json
+    python rank_card_benchmark.py --modes inline --format webp --max-kb 40
+
+Modes:
+    legacy  - the original generate_rank_card: per-line gradients, per-call font lookups and
+              avatar/icon decoding on every card (always default PNG)
+    inline  - the current renderer called directly (cached template, fonts and assets)
+    pool    - the current renderer through a process pool, as the bot runs it
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import numpy as np
+import PIL
+from PIL import Image, ImageDraw, ImageFont
+
+import rank_card
+from rank_card import RankCardRequest, generate_rank_card, mask_circle
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+LEVELS = [1, 10, 50, 100]
+PROGRESS_FRACTIONS = [0.0, 0.25, 0.5, 0.99]
+CHILD_POLL_SECONDS = 5  # how often to check that a mode's process is still alive while waiting on it
+
+
+def calculate_xp_for_level(level):
+    """Same XP curve as the bot"""
+    if level <= 1:
+        return 0
+    return level * level * 100 + (level * 50)
+
+
+def make_stub_asset(size, seed):
+    """Build PNG bytes that look like a CDN avatar/icon (noisy, so they compress realistically)"""
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, size=(size, size, 3), dtype=np.uint8)
+    img_bytes = BytesIO()
+    Image.fromarray(pixels, 'RGB').save(img_bytes, format='PNG')
+    return img_bytes.getvalue()
+
+
+def build_cases(avatar_bytes, icon_bytes, image_format='png', max_bytes=None):
+    """Build one render request per (level, progress) combination"""
+    avatar_image = mask_circle(Image.open(BytesIO(avatar_bytes)), 100)
+    icon_image = mask_circle(Image.open(BytesIO(icon_bytes)), 60)
+
+    cases = []
+    for level in LEVELS:
+        xp_for_current = calculate_xp_for_level(level)
+        xp_for_next = calculate_xp_for_level(level + 1)
+        for fraction in PROGRESS_FRACTIONS:
+            current_xp = xp_for_current + int((xp_for_next - xp_for_current) * fraction)
+            cases.append(RankCardRequest(
+                username=f"benchmark_user_{level}",
+                level=level,
+                current_xp=current_xp,
+                xp_for_current=xp_for_current,
+                xp_for_next=xp_for_next,
+                rank_position=level,
+                avatar_image=avatar_image,
+                guild_icon_image=icon_image,
+                image_format=image_format,
+                max_bytes=max_bytes
+            ))
+    return cases
+
+
+def generate_rank_card_legacy(request, avatar_bytes, icon_bytes):
+    """The original generate_rank_card, minus the HTTP fetches (the asset bytes are passed in)"""
+    width, height = 700, 250
+    card = Image.new('RGB', (width, height))
+    draw = ImageDraw.Draw(card)
+
+    for y in range(height):
+        r = int(25 + (y / height) * 30)
+        g = int(30 + (y / height) * 35)
+        b = int(40 + (y / height) * 60)
+        draw.line([(0, y), (width, y)], fill=(r, g, b))
+
+    draw.rectangle([0, 0, width, 30], fill=(70, 80, 150, 180))
+    draw.rectangle([0, height-30, width, height], fill=(70, 80, 150, 180))
+
+    try:
+        name_font = ImageFont.truetype("arial.ttf", 30)
+        level_font = ImageFont.truetype("arial.ttf", 40)
+        stat_font = ImageFont.truetype("arial.ttf", 16)
+        small_stat_font = ImageFont.truetype("arial.ttf", 14)
+    except OSError:
+        name_font = ImageFont.load_default()
+        level_font = ImageFont.load_default()
+        stat_font = ImageFont.load_default()
+        small_stat_font = ImageFont.load_default()
+
+    avatar = Image.open(BytesIO(avatar_bytes)).convert('RGBA')
+    avatar = avatar.resize((100, 100), Image.Resampling.LANCZOS)
+    mask = Image.new('L', (100, 100), 0)
+    ImageDraw.Draw(mask).ellipse([0, 0, 100, 100], fill=255)
+    draw.ellipse([22, 25, 132, 135], outline=(255, 215, 0), width=4)
+    card.paste(avatar, (27, 30), mask)
+
+    username = request.username[:20]
+    draw.text((140, 35), username, font=name_font, fill=(255, 255, 255))
+    draw.text((141, 36), username, font=name_font, fill=(0, 0, 0, 128))
+
+    level_bg_top = (88, 101, 242)
+    level_bg_bottom = (155, 89, 182)
+    for y in range(30, 80):
+        gradient_factor = (y - 30) / (80 - 30)
+        r = int(level_bg_top[0] + (level_bg_bottom[0] - level_bg_top[0]) * gradient_factor)
+        g = int(level_bg_top[1] + (level_bg_bottom[1] - level_bg_top[1]) * gradient_factor)
+        b = int(level_bg_top[2] + (level_bg_bottom[2] - level_bg_top[2]) * gradient_factor)
+        draw.line([(550, y), (670, y)], fill=(r, g, b))
+
+    draw.rounded_rectangle([550, 30, 670, 80], radius=15, fill=None, outline=(255, 255, 255), width=2)
+    draw.text((595, 40), f"LVL {request.level}", font=level_font, fill=(255, 255, 255))
+    draw.text((140, 75), f"Rank: #{request.rank_position}", font=stat_font, fill=(255, 215, 0))
+
+    bar_width, bar_height, bar_x, bar_y = 500, 25, 140, 120
+    for x in range(bar_width):
+        gradient_pos = x / bar_width
+        r = int(60 + gradient_pos * 40)
+        g = int(60 + gradient_pos * 30)
+        b = int(80 + gradient_pos * 20)
+        draw.line([(bar_x + x, bar_y), (bar_x + x, bar_y + bar_height)], fill=(r, g, b))
+
+    xp_in_level = request.current_xp - request.xp_for_current
+    xp_needed = request.xp_for_next - request.xp_for_current
+    progress_width = int((xp_in_level / xp_needed) * bar_width) if xp_needed > 0 else 0
+    for i in range(progress_width):
+        hue_pos = (i / progress_width) * 6
+        if hue_pos < 1:
+            r, g, b = 255, int(255 * hue_pos), 0
+        elif hue_pos < 2:
+            r, g, b = int(255 * (2 - hue_pos)), 255, 0
+        elif hue_pos < 3:
+            r, g, b = 0, 255, int(255 * (hue_pos - 2))
+        elif hue_pos < 4:
+            r, g, b = 0, int(255 * (4 - hue_pos)), 255
+        elif hue_pos < 5:
+            r, g, b = int(255 * (hue_pos - 4)), 0, 255
+        else:
+            r, g, b = 255, 0, int(255 * (6 - hue_pos))
+        draw.line([(bar_x + i, bar_y), (bar_x + i, bar_y + bar_height)], fill=(r, g, b))
+
+    draw.rounded_rectangle([bar_x, bar_y, bar_x + bar_width, bar_y + bar_height], radius=12, outline=(255, 255, 255), width=2)
+
+    xp_text = f"{xp_in_level:,} / {xp_needed:,} XP"
+    text_bbox = draw.textbbox((0, 0), xp_text, font=small_stat_font)
+    text_x = bar_x + (bar_width - (text_bbox[2] - text_bbox[0])) // 2
+    draw.text((text_x, bar_y + 5), xp_text, font=small_stat_font, fill=(255, 255, 255))
+    draw.text((140, 160), f"Total XP: {request.current_xp:,}", font=stat_font, fill=(200, 230, 255))
+
+    logo = Image.open(BytesIO(icon_bytes)).convert('RGBA')
+    logo = logo.resize((60, 60), Image.Resampling.LANCZOS)
+    logo_mask = Image.new('L', (60, 60), 0)
+    ImageDraw.Draw(logo_mask).ellipse([0, 0, 60, 60], fill=255)
+    icon_frame_x, icon_frame_y = width - 80, height - 80
+    draw.ellipse([icon_frame_x - 5, icon_frame_y - 5, icon_frame_x + 65, icon_frame_y + 65], outline=(255, 215, 0), width=3)
+    card.paste(logo, (icon_frame_x, icon_frame_y), logo_mask)
+
+    draw.rectangle([0, 0, width-1, height-1], outline=(100, 150, 255), width=3)
+
+    img_bytes = BytesIO()
+    card.save(img_bytes, format='PNG')
+    return img_bytes.getvalue()
+
+
+def get_peak_rss_kb(include_children=False):
+    """Peak resident set size of this process (and optionally its finished children) in KB"""
+    if resource is None:
+        import psutil
+        return psutil.Process().memory_info().rss // 1024
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if include_children:
+        peak = max(peak, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    if sys.platform == 'darwin':
+        peak //= 1024  # macOS reports bytes
+    return peak
+
+
+def summarize(latencies_ms):
+    """Reduce a list of latencies to the numbers worth comparing"""
+    ordered = sorted(latencies_ms)
+    return {
+        'mean_ms': round(statistics.fmean(ordered), 3),
+        'p50_ms': round(ordered[len(ordered) // 2], 3),
+        'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+        'min_ms': round(ordered[0], 3),
+        'max_ms': round(ordered[-1], 3)
+    }
+
+
+def run_mode(mode, iterations, workers, concurrency, image_format, max_bytes):
+    """Benchmark one mode in the current process and return its results"""
+    avatar_bytes = make_stub_asset(128, seed=1)
+    icon_bytes = make_stub_asset(64, seed=2)
+    cases = build_cases(avatar_bytes, icon_bytes, image_format, max_bytes)
+
+    # The first render pays for template, font and import setup - report it on its own
+    start = time.perf_counter()
+    if mode == 'legacy':
+        generate_rank_card_legacy(cases[0], avatar_bytes, icon_bytes)
+    else:
+        generate_rank_card(cases[0])
+    cold_start_ms = (time.perf_counter() - start) * 1000
+
+    case_results = []
+    all_latencies = []
+
+    if mode == 'pool':
+        mp_context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) as pool:
+            list(pool.map(generate_rank_card, cases[:workers]))  # warm every worker
+
+            for request in cases:
+                # Submit a burst like concurrent /rankcard calls and time each job end to end
+                latencies = []
+                for _ in range(max(1, iterations // concurrency)):
+                    submitted = [(time.perf_counter(), pool.submit(generate_rank_card, request)) for _ in range(concurrency)]
+                    for submitted_at, future in submitted:
+                        card_bytes = future.result().data
+                        latencies.append((time.perf_counter() - submitted_at) * 1000)
+                case_results.append({
+                    'level': request.level,
+                    'progress_width': rank_card.get_progress_width(request.current_xp, request.xp_for_current, request.xp_for_next),
+                    'output_bytes': len(card_bytes),
+                    **summarize(latencies)
+                })
+                all_latencies.extend(latencies)
+
+            batch_start = time.perf_counter()
+            list(pool.map(generate_rank_card, cases * max(1, iterations // 4)))
+            batch_seconds = time.perf_counter() - batch_start
+            throughput = len(cases) * max(1, iterations // 4) / batch_seconds
+    else:
+        for request in cases:
+            latencies = []
+            for _ in range(iterations):
+                start = time.perf_counter()
+                if mode == 'legacy':
+                    card_bytes = generate_rank_card_legacy(request, avatar_bytes, icon_bytes)
+                else:
+                    card_bytes = generate_rank_card(request).data
+                latencies.append((time.perf_counter() - start) * 1000)
+            case_results.append({
+                'level': request.level,
+                'progress_width': rank_card.get_progress_width(request.current_xp, request.xp_for_current, request.xp_for_next),
+                'output_bytes': len(card_bytes),
+                **summarize(latencies)
+            })
+            all_latencies.extend(latencies)
+        throughput = 1000 / statistics.fmean(all_latencies)
+
+    return {
+        'cold_start_ms': round(cold_start_ms, 3),
+        'summary': summarize(all_latencies),
+        'cards_per_second': round(throughput, 1),
+        'mean_output_bytes': round(statistics.fmean(case['output_bytes'] for case in case_results)),
+        'peak_rss_kb': get_peak_rss_kb(include_children=(mode == 'pool')),
+        'cases': case_results
+    }
+
+
+def run_mode_in_child(mode, iterations, workers, concurrency, image_format, max_bytes, results):
+    """Entry point for the per-mode child process"""
+    results.put(run_mode(mode, iterations, workers, concurrency, image_format, max_bytes))
+
+
+def wait_for_child_results(process, results):
+    """Wait for a mode's results, returning None if its process died without sending them"""
+    while True:
+        try:
+            return results.get(timeout=CHILD_POLL_SECONDS)
+        except queue.Empty:
+            if not process.is_alive():
+                # It may have sent them just before exiting
+                try:
+                    return results.get(timeout=1)
+                except queue.Empty:
+                    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark rank card rendering offline")
+    parser.add_argument('--modes', nargs='+', choices=['legacy', 'inline', 'pool'], default=['legacy', 'inline', 'pool'])
+    parser.add_argument('--iterations', type=int, default=20, help="renders per level/progress case")
+    parser.add_argument('--workers', type=int, default=2, help="process pool size for the pool mode")
+    parser.add_argument('--concurrency', type=int, default=4, help="simultaneous jobs per burst in the pool mode")
+    parser.add_argument('--format', dest='image_format', choices=list(rank_card.IMAGE_FORMATS), default='png',
+                        help="output encoding for the inline and pool modes")
+    parser.add_argument('--max-kb', type=int, default=0, help="byte budget in KB for the encoder (0 for none)")
+    parser.add_argument('--output', default='rank_card_benchmark.json', help="where to write the JSON results")
+    args = parser.parse_args()
+
+    results = {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'pillow': PIL.__version__,
+            'numpy': np.__version__,
+            'cpu_count': os.cpu_count(),
+            'font': rank_card.discover_rank_card_font()
+        },
+        'settings': {
+            'iterations': args.iterations,
+            'workers': args.workers,
+            'concurrency': args.concurrency,
+            'image_format': args.image_format,
+            'max_bytes': args.max_kb * 1024 or None,
+            'levels': LEVELS,
+            'progress_fractions': PROGRESS_FRACTIONS
+        },
+        'modes': {}
+    }
+
+    # Each mode runs in its own process so peak RSS numbers don't bleed into each other
+    spawn = multiprocessing.get_context('spawn')
+    failed_modes = []
+    for mode in args.modes:
+        result_queue = spawn.Queue()
+        process = spawn.Process(target=run_mode_in_child, args=(mode, args.iterations, args.workers, args.concurrency,
+                                                                      args.image_format, args.max_kb * 1024 or None, result_queue))
+        process.start()
+        mode_results = wait_for_child_results(process, result_queue)
+        process.join()
+        if mode_results is None:
+            # Crashed (OOM, a Pillow segfault, an exception) - report it and carry on with the other modes
+            results['modes'][mode] = {'error': f"child process exited with code {process.exitcode}"}
+            failed_modes.append(mode)
+            print(f"{mode:>7}: FAILED - child process exited with code {process.exitcode}")
+            continue
+        results['modes'][mode] = mode_results
+
+        summary = mode_results['summary']
+        print(f"{mode:>7}: mean {summary['mean_ms']:.2f} ms, p95 {summary['p95_ms']:.2f} ms, "
+              f"{mode_results['cards_per_second']:.1f} cards/s, cold {mode_results['cold_start_ms']:.1f} ms, "
+              f"peak RSS {mode_results['peak_rss_kb'] / 1024:.1f} MB, output ~{mode_results['mean_output_bytes'] / 1024:.1f} KB")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+    if failed_modes:
+        sys.exit(f"Failed modes: {', '.join(failed_modes)}")
+
+
+if __name__ == "__main__":
+    main()